@@ -1,30 +1,56 @@
 import streamlit as st
 import pandas as pd
 import time
+import uuid
+import tempfile
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
 from data.db_manager import (
     init_db,
     add_user,
-    authenticate_user,
-    get_user_role,
-    get_all_students,
+    login_user,
+    search_students,
+    count_students,
+    get_student_groups,
+    get_students_statistics,
     get_student_data,
-    create_test,
+    create_test_with_questions,
     get_teacher_tests,
     get_test_questions,
     get_available_tests,
     submit_test_answers,
-    create_secure_question,
+    SubmissionRejected,
     get_test_results,
     get_test_by_id,
-    get_group_statistics,
+    start_test_session,
+    get_test_session,
+    start_session_sweeper,
     get_student_progress,
-    get_test_analytics,
-    get_student_ranking,
-    get_teacher_dashboard_stats
+    get_group_progress,
+    get_question_statistics,
+    get_option_statistics,
+    update_answer_key,
+    regrade_test,
+    get_leaderboard,
+    get_ranking_groups,
+    get_teacher_dashboard_stats,
+    get_writer_stats,
+    get_cache_stats,
+    write_results_export,
+    EXPORT_FORMATS
 )
+from data.analytics import (
+    load_results_frame,
+    grade_distribution,
+    percentile_summary,
+    group_summary,
+    test_summary,
+    student_summary,
+    group_test_pivot,
+    activity_series
+)
+from data.item_analysis import get_item_analysis
 
 # НАСТРОЙКИ СТРАНИЦЫ
 st.set_page_config(
@@ -37,6 +63,9 @@ st.set_page_config(
 # Инициализация базы данных
 init_db()
 
+# Фоновое закрытие просроченных сессий тестирования (один поток на процесс)
+start_session_sweeper()
+
 # CSS с поддержкой темной темы
 def inject_custom_css():
     st.markdown("""
@@ -137,7 +166,8 @@ def initialize_session_state():
             "test_questions": [],
             "test_started": False,
             "current_test": None,
-            "test_start_time": None,
+            "test_session_id": None,
+            "submission_token": None,
             "last_test_result": None
         })
 
@@ -240,19 +270,18 @@ def handle_login(username: str, password: str):
         return
         
     with st.spinner("🔐 Проверка учетных данных..."):
-        time.sleep(0.5)  # Короткая задержка для UX
-        if authenticate_user(username, password):
-            st.session_state.update({
-                "username": username,
-                "role": get_user_role(username),
-                "last_login": datetime.now().strftime("%d.%m.%Y %H:%M"),
-                "mode": "login"
-            })
-            st.success("✅ Успешный вход! Перенаправляем...")
-            time.sleep(1)
-            st.rerun()
-        else:
-            st.error("❌ Неверный логин или пароль")
+        user = login_user(username, password)
+
+    if user:
+        st.session_state.update({
+            "username": user["username"],
+            "role": user["role"],
+            "last_login": datetime.now().strftime("%d.%m.%Y %H:%M"),
+            "mode": "login"
+        })
+        st.rerun()
+    else:
+        st.error("❌ Неверный логин или пароль")
 
 # ФОРМА РЕГИСТРАЦИИ
 def show_register_form():
@@ -406,61 +435,118 @@ def show_teacher_dashboard():
     with col3:
         st.metric("📊 Групп", dashboard_stats['total_groups'])
     
+    # Одна выборка результатов по тестам преподавателя на все вкладки аналитики
+    results = load_results_frame(created_by=st.session_state.username)
+    
     # Вкладки аналитики
-    tab1, tab2, tab3, tab4 = st.tabs([
-        "📈 Общая статистика", "👥 По группам", "🧩 Аналитика тестов", "🏆 Рейтинг"
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+        "📈 Общая статистика", "👥 По группам", "🧩 Аналитика тестов", "🏆 Рейтинг", "📤 Выгрузка"
     ])
     
     with tab1:
-        show_general_statistics()
+        show_general_statistics(results)
     with tab2:
-        show_group_analytics()
+        show_group_analytics(results)
     with tab3:
-        show_test_analytics_interface()
+        show_test_analytics_interface(results)
     with tab4:
-        show_student_ranking()
+        show_student_ranking(results)
+    with tab5:
+        show_results_export()
+
+def show_results_export():
+    """Выгрузка результатов в CSV/JSONL"""
+    st.markdown("#### 📤 Выгрузка результатов")
+    
+    tests = {"Все мои тесты": None}
+    tests.update({f"{test['id']}: {test['title']}": test['id'] for test in get_teacher_tests(st.session_state.username)})
+    groups = {"Все группы": None}
+    groups.update({group: group for group in get_student_groups()})
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        test_id = tests[st.selectbox("Тест", list(tests), key="export_test")]
+        date_range = st.date_input("Период", value=(), key="export_range")
+    with col2:
+        group_name = groups[st.selectbox("Группа", list(groups), key="export_group")]
+        fmt = st.radio("Формат", list(EXPORT_FORMATS), horizontal=True, key="export_format",
+                       format_func=str.upper)
+    
+    filters = {
+        'test_id': test_id,
+        'group_name': group_name,
+        'date_from': date_range[0].isoformat() if len(date_range) > 0 else None,
+        'date_to': date_range[1].isoformat() if len(date_range) > 1 else None,
+        'created_by': st.session_state.username
+    }
+    
+    def build_export():
+        # Выполняется по нажатию кнопки в отдельном потоке: строки читаются порциями
+        # и сразу пишутся во временный файл, список всех результатов не собирается
+        f = tempfile.TemporaryFile()
+        write_results_export(f, fmt, **filters)
+        f.seek(0)
+        return f
+    
+    st.download_button(
+        "⬇️ Скачать",
+        data=build_export,
+        file_name=f"results_{datetime.now():%Y%m%d_%H%M}.{fmt}",
+        mime=EXPORT_FORMATS[fmt]['mime'],
+        key="export_download"
+    )
+    st.caption("Большие выгрузки удобнее делать из консоли: python export_results.py results.csv --test 1")
 
-def show_general_statistics():
+def show_general_statistics(results: pd.DataFrame):
     """Общая статистика системы"""
     st.markdown("#### 📈 Активность системы")
-    st.info("📊 Графики активности появятся после накопления данных")
+    activity = activity_series(results)
+    if activity.empty:
+        st.info("📊 Графики активности появятся после накопления данных")
+    else:
+        col1, col2 = st.columns(2)
+        with col1:
+            fig = px.bar(activity, y="attempts", title="Попыток в день",
+                         labels={"completed_at": "Дата", "attempts": "Попыток"})
+            st.plotly_chart(fig, use_container_width=True)
+        with col2:
+            fig = px.line(activity.dropna(), y="avg_success_rate", markers=True, title="Средний % по дням",
+                          labels={"completed_at": "Дата", "avg_success_rate": "Средний %"})
+            st.plotly_chart(fig, use_container_width=True)
     
     st.markdown("#### 👥 Статистика по группам")
     try:
-        students = get_all_students()
-        groups = list(set([student["group"] for student in students if student["group"]]))
-        
-        for group in groups:
-            stats = get_group_statistics(group)
-            if stats:
-                with st.container():
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric(f"👥 {group}", f"{stats['student_count']} студентов")
-                    with col2:
-                        st.metric("📊 Средний %", f"{stats['avg_success_rate']}%")
-                    with col3:
-                        st.metric("🧩 Тестов", stats['total_tests'])
-                    with col4:
-                        st.metric("🔄 Попыток", stats['total_attempts'])
-                    
-                    if stats['grade_distribution']:
-                        st.write("**Распределение оценок:**")
-                        for grade_range, count in stats['grade_distribution'].items():
-                            percentage = (count / stats['total_attempts'] * 100) if stats['total_attempts'] > 0 else 0
-                            st.write(f"{grade_range}: {count} ({percentage:.1f}%)")
-                            st.progress(percentage / 100)
-                    
-                    st.markdown("---")
+        for group, stats in group_summary(results).iterrows():
+            with st.container():
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric(f"👥 {group}", f"{stats['student_count']} студентов")
+                with col2:
+                    st.metric("📊 Средний %", f"{stats['avg_success_rate']}%",
+                              help=f"Медиана: {stats['median_success_rate']}%")
+                with col3:
+                    st.metric("🧩 Тестов", stats['total_tests'])
+                with col4:
+                    st.metric("🔄 Попыток", stats['total_attempts'])
+                
+                distribution = grade_distribution(results[results['group_name'] == group])
+                if not distribution.empty:
+                    st.write("**Распределение оценок:**")
+                    for grade_range, count in distribution.items():
+                        percentage = count / stats['total_attempts'] * 100
+                        st.write(f"{grade_range}: {count} ({percentage:.1f}%)")
+                        st.progress(percentage / 100)
+                
+                st.markdown("---")
     except Exception as e:
         st.error(f"Ошибка при загрузке статистики: {e}")
 
-def show_group_analytics():
+def show_group_analytics(results: pd.DataFrame):
     """Детальная аналитика по группам"""
     st.markdown("#### 👥 Детальная аналитика по группам")
     
-    students = get_all_students()
-    groups = list(set([student["group"] for student in students if student["group"]]))
+    summary = group_summary(results)
+    groups = list(summary.index)
     
     if not groups:
         st.info("📭 Нет данных о группах")
@@ -469,27 +555,35 @@ def show_group_analytics():
     selected_group = st.selectbox("Выберите группу для анализа:", groups, key="group_analytics_select")
     
     if selected_group:
-        stats = get_group_statistics(selected_group)
-        if stats:
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown("##### 📊 Основные метрики")
-                st.write(f"**Студентов в группе:** {stats['student_count']}")
-                st.write(f"**Всего тестов пройдено:** {stats['total_tests']}")
-                st.write(f"**Всего попыток:** {stats['total_attempts']}")
-                st.write(f"**Средний процент успеха:** {stats['avg_success_rate']}%")
-                st.write(f"**Лучший результат:** {stats['max_success_rate']}%")
-                st.write(f"**Худший результат:** {stats['min_success_rate']}%")
-            
-            with col2:
-                st.markdown("##### 📈 Распределение оценок")
-                if stats['grade_distribution']:
-                    grades = list(stats['grade_distribution'].keys())
-                    counts = list(stats['grade_distribution'].values())
-                    fig = px.bar(x=grades, y=counts, title=f"Распределение оценок - {selected_group}")
-                    st.plotly_chart(fig, use_container_width=True)
-
-def show_test_analytics_interface():
+        stats = summary.loc[selected_group]
+        group_results = results[results['group_name'] == selected_group]
+        percentiles = percentile_summary(group_results)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("##### 📊 Основные метрики")
+            st.write(f"**Студентов в группе:** {stats['student_count']}")
+            st.write(f"**Всего тестов пройдено:** {stats['total_tests']}")
+            st.write(f"**Всего попыток:** {stats['total_attempts']}")
+            st.write(f"**Средний процент успеха:** {stats['avg_success_rate']}%")
+            st.write(f"**Медиана:** {percentiles['median']}% "
+                     f"(25%: {percentiles['p25']}%, 75%: {percentiles['p75']}%, 90%: {percentiles['p90']}%)")
+            st.write(f"**Лучший результат:** {stats['max_success_rate']}%")
+            st.write(f"**Худший результат:** {stats['min_success_rate']}%")
+        
+        with col2:
+            st.markdown("##### 📈 Распределение оценок")
+            distribution = grade_distribution(group_results)
+            if not distribution.empty:
+                fig = px.bar(x=distribution.index.astype(str), y=distribution.values,
+                             title=f"Распределение оценок - {selected_group}")
+                st.plotly_chart(fig, use_container_width=True)
+        
+        pivot = group_test_pivot(group_results)
+        if not pivot.empty:
+            st.markdown("##### 🧩 Средний % по тестам")
+            st.dataframe(pivot.T.rename(columns={selected_group: "Средний %"}), use_container_width=True)
+
+def show_test_analytics_interface(results: pd.DataFrame):
     """Интерфейс аналитики тестов"""
     st.markdown("#### 🧩 Аналитика тестов")
     
@@ -503,42 +597,51 @@ def show_test_analytics_interface():
     
     if selected_test_title:
         test_id = int(selected_test_title.split(":")[0])
-        analytics = get_test_analytics(test_id)
+        test = next(test for test in tests if test['id'] == test_id)
+        test_results = results[results['test_id'] == test_id]
+        summary = test_summary(test_results)
         
-        if analytics and 'title' in analytics:
-            st.markdown(f"##### 📝 {analytics['title']}")
-            if analytics.get('description'):
-                st.write(f"_{analytics['description']}_")
-            
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("🔄 Попыток", analytics.get('total_attempts', 0))
-            with col2:
-                st.metric("📊 Средний балл", f"{analytics.get('avg_score', 0):.1f}")
-            with col3:
-                st.metric("⭐ Средний %", f"{analytics.get('avg_success_rate', 0)}%")
-            with col4:
-                st.metric("❓ Вопросов", analytics.get('question_count', 0))
-            
-            if analytics.get('total_attempts', 0) > 0:
-                show_detailed_test_analytics(analytics)
-            else:
-                st.info("🎯 Этот тест еще никто не прошел")
+        st.markdown(f"##### 📝 {test['title']}")
+        if test.get('description'):
+            st.write(f"_{test['description']}_")
+        
+        if summary.empty:
+            st.metric("❓ Вопросов", test['question_count'])
+            st.info("🎯 Этот тест еще никто не прошел")
+            return
+        
+        stats = summary.iloc[0]
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("🔄 Попыток", int(stats['total_attempts']))
+        with col2:
+            st.metric("📊 Средний балл", f"{stats['avg_score']:.1f}")
+        with col3:
+            st.metric("⭐ Средний %", f"{stats['avg_success_rate']}%",
+                      help=f"Медиана: {stats['median_success_rate']}%")
+        with col4:
+            st.metric("❓ Вопросов", test['question_count'])
+        
+        show_detailed_test_analytics(test_results, stats)
+        show_question_statistics(test_id)
+        show_option_statistics(test_id)
+        show_item_analysis(test_id)
 
-def show_detailed_test_analytics(analytics: dict):
+def show_detailed_test_analytics(test_results: pd.DataFrame, stats: pd.Series):
     """Показывает детальную аналитику теста"""
     # Распределение оценок
     st.markdown("##### 📈 Распределение оценок")
-    grade_distribution = analytics.get('grade_distribution', {})
-    if grade_distribution:
-        grades = list(grade_distribution.keys())
-        counts = list(grade_distribution.values())
-        fig = px.pie(values=counts, names=grades, title="Распределение результатов")
+    bins = {"Оценки": None, "По 10%": 10, "По 20%": 20}
+    bin_choice = st.radio("Диапазоны", list(bins), horizontal=True, key="test_analytics_bins")
+    distribution = grade_distribution(test_results, step=bins[bin_choice])
+    if not distribution.empty:
+        fig = px.pie(values=distribution.values, names=distribution.index.astype(str),
+                     title="Распределение результатов")
         st.plotly_chart(fig, use_container_width=True)
         
         st.write("**Детальное распределение:**")
-        total_attempts = analytics.get('total_attempts', 1)
-        for grade_range, count in grade_distribution.items():
+        total_attempts = int(stats['total_attempts'])
+        for grade_range, count in distribution.items():
             percentage = (count / total_attempts * 100)
             st.write(f"{grade_range}: {count} студентов ({percentage:.1f}%)")
             st.progress(percentage / 100)
@@ -547,107 +650,302 @@ def show_detailed_test_analytics(analytics: dict):
     
     # Дополнительная статистика
     st.markdown("##### 📊 Дополнительная статистика")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("🎯 Лучший результат", f"{stats['max_score_achieved']:.0f} баллов")
+    with col2:
+        st.metric("📉 Худший результат", f"{stats['min_score_achieved']:.0f} баллов")
+    with col3:
+        st.metric("⏱️ Среднее время", f"{stats['avg_time_spent']} сек")
+    with col4:
+        st.metric("📐 Межквартильный размах", 
+                  f"{stats['p25_success_rate']}–{stats['p75_success_rate']}%")
+
+def show_question_statistics(test_id: int):
+    """Статистика по вопросам теста"""
+    st.markdown("##### ❓ Статистика по вопросам")
+    questions = get_question_statistics(test_id)
+    if not questions or not any(question['attempts'] for question in questions):
+        st.info("📭 Нет ответов по вопросам")
+        return
+    
+    def difficulty_label(p):
+        if p is None:
+            return "—"
+        return "легкий" if p >= 0.7 else "средний" if p >= 0.3 else "сложный"
+    
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "№": number,
+                "Вопрос": question['question_text'],
+                "Ответили": f"{question['answered']}/{question['attempts']}",
+                "Верно, %": question['success_rate'],
+                "Индекс трудности": question['difficulty_index'],
+                "Сложность": difficulty_label(question['difficulty_index']),
+                "Средний балл": f"{question['avg_points']}/{question['points']}"
+            } for number, question in enumerate(questions, 1)
+        ]),
+        hide_index=True,
+        use_container_width=True
+    )
+
+def show_option_statistics(test_id: int):
+    """Анализ дистракторов: частота выбора вариантов ответа"""
+    st.markdown("##### 🎯 Выбор вариантов ответа")
+    questions = [question for question in get_option_statistics(test_id) if question['answered']]
+    if not questions:
+        st.info("📭 Нет ответов на вопросы с выбором варианта")
+        return
+    
+    labels = {f"{question['question_order']}. {question['question_text']}": question for question in questions}
+    question = labels[st.selectbox("Вопрос", list(labels), key=f"option_stats_{test_id}")]
+    
+    options = pd.DataFrame(question['options'])
+    options['Вариант'] = options['is_correct'].map({True: "✅ Верный", False: "Дистрактор"})
+    fig = px.bar(options, x='times', y='option', color='Вариант', orientation='h',
+                 text=options['share'].map(lambda share: f"{share}%"),
+                 labels={'times': 'Выбрали', 'option': ''},
+                 title=f"Ответили: {question['answered']} из {question['attempts']}",
+                 color_discrete_map={"✅ Верный": "#2ca02c", "Дистрактор": "#1f77b4"})
+    fig.update_layout(yaxis={'categoryorder': 'array', 'categoryarray': options['option'].tolist()[::-1]})
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Дистрактор, который никто не выбирает, не работает; выбираемый чаще верного - повод проверить формулировку
+    correct_times = options.loc[options['is_correct'], 'times'].max() if options['is_correct'].any() else 0
+    unused = options[~options['is_correct'] & (options['times'] == 0)]['option'].tolist()
+    misleading = options[~options['is_correct'] & (options['times'] > correct_times)]['option'].tolist()
+    if unused:
+        st.caption(f"💤 Никто не выбрал: {', '.join(unused)}")
+    if misleading:
+        st.warning(f"⚠️ Выбирают чаще верного ответа: {', '.join(misleading)}")
+
+def show_item_analysis(test_id: int):
+    """Психометрический анализ заданий теста"""
+    st.markdown("##### 🔬 Анализ заданий")
+    analysis = get_item_analysis(test_id)
+    if analysis['students'] < 2:
+        st.info("📭 Для анализа заданий нужны результаты хотя бы двух студентов")
+        return
+    
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("🎯 Лучший результат", f"{analytics.get('max_score_achieved', 0)} баллов")
+        st.metric("👥 Студентов", analysis['students'], help="Учитывается первая попытка каждого студента")
     with col2:
-        st.metric("📉 Худший результат", f"{analytics.get('min_score_achieved', 0)} баллов")
+        alpha = analysis['alpha']
+        st.metric("🧮 Альфа Кронбаха", "—" if alpha is None else f"{alpha:.2f}",
+                  help="Надежность теста: 0.7 и выше - приемлемо")
     with col3:
-        st.metric("⏱️ Среднее время", f"{analytics.get('avg_time_spent', 0)} сек")
+        st.metric("📊 Средний балл", f"{analysis['mean_score']} ± {analysis['std_score'] or 0}")
+    
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "№": number,
+                "Вопрос": item['question_text'],
+                "Трудность (p)": item['difficulty'],
+                "Дискриминативность (D)": item['discrimination'],
+                "Точечно-бисериальная r": item['point_biserial'],
+                "Альфа без задания": item['alpha_if_deleted'],
+                "Замечания": ", ".join(item['flags']) or "✅"
+            } for number, item in enumerate(analysis['items'], 1)
+        ]),
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    flagged = [item for item in analysis['items'] if item['flags']]
+    if flagged:
+        st.warning(f"⚠️ Заданий, которые стоит проверить: {len(flagged)} из {len(analysis['items'])}")
 
-def show_student_ranking():
+def show_student_ranking(results: pd.DataFrame):
     """Рейтинг студентов"""
     st.markdown("#### 🏆 Рейтинг студентов")
     
-    ranking = get_student_ranking()
-    if not ranking:
+    groups = get_ranking_groups()
+    if not groups and not get_leaderboard(limit=1)['rows']:
         st.info("📭 Пока нет данных для рейтинга")
         return
     
-    st.markdown("##### Топ-20 студентов по успеваемости")
-    for student in ranking:
-        with st.container():
-            col1, col2, col3, col4, col5 = st.columns([1, 3, 2, 2, 2])
-            with col1:
-                emoji = "🥇" if student['rank'] == 1 else "🥈" if student['rank'] == 2 else "🥉" if student['rank'] == 3 else "🏅"
-                st.write(f"**{emoji} #{student['rank']}**")
-            with col2:
-                st.write(f"**{student['full_name']}**")
-                st.write(f"Группа: {student['group']}")
-            with col3:
-                st.write(f"📊 {student['avg_success_rate']}%")
-            with col4:
-                st.write(f"🧩 {student['tests_completed']} тестов")
-            with col5:
-                st.write(f"⭐ {student['total_points']} баллов")
-            st.markdown("---")
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        scope = st.selectbox("Рейтинг", ["Общий"] + groups, key="ranking_scope")
+    with col2:
+        page_size = st.selectbox("Строк на странице", [20, 50, 100], key="ranking_page_size")
+    
+    # Курсоры просмотренных страниц; при смене фильтра начинаем с первой
+    state_key = (scope, page_size)
+    if st.session_state.get("ranking_state_key") != state_key:
+        st.session_state.ranking_state_key = state_key
+        st.session_state.ranking_cursors = [None]
+    cursors = st.session_state.ranking_cursors
+    
+    group_name = None if scope == "Общий" else scope
+    page = get_leaderboard(group_name=group_name, limit=page_size, cursor=cursors[-1])
+    
+    # Разброс средних процентов студентов в выбранном рейтинге
+    students = student_summary(results)
+    if group_name is not None:
+        students = students[students['group_name'] == group_name]
+    if not students.empty:
+        averages = students['avg_success_rate']
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Медиана среднего %", f"{averages.median():.1f}%")
+        with col2:
+            st.metric("Верхние 10% от", f"{averages.quantile(0.9):.1f}%")
+        with col3:
+            st.metric("Нижние 25% до", f"{averages.quantile(0.25):.1f}%")
+    
+    st.markdown(f"##### Страница {len(cursors)}" + ("" if group_name is None else f" · группа {group_name}"))
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "Место": f"{medals.get(student['rank'], '🏅')} {student['rank']}",
+                "Студент": student['full_name'] or student['username'],
+                "Группа": student['group'],
+                "Средний %": student['avg_success_rate'],
+                "Тестов": student['tests_completed'],
+                "Баллов": student['total_points'],
+                "Место в общем рейтинге": student['global_rank']
+            } for student in page['rows']
+        ]),
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("⬅️ Назад", key="ranking_prev", use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if page['next_cursor'] and st.button("Далее ➡️", key="ranking_next", use_container_width=True):
+            cursors.append(page['next_cursor'])
+            st.rerun()
 
 def show_students_management():
     """Управление студентами"""
     st.markdown("### 👥 Управление студентами")
 
     # Поиск и фильтры
-    col1, col2 = st.columns([2, 1])
+    col1, col2, col3 = st.columns([2, 1, 1])
     with col1:
-        search = st.text_input("🔍 Поиск студента по имени", key="student_search")
+        search = st.text_input("🔍 Поиск по имени, логину, email или группе", key="student_search")
     with col2:
-        students = get_all_students()
-        groups = list(set([student["group"] for student in students if student["group"]]))
+        groups = get_student_groups()
         groups.insert(0, "Все")
         filter_group = st.selectbox("Группа", groups, key="group_filter")
+    with col3:
+        page_size = st.selectbox("На странице", [10, 25, 50], key="students_page_size")
 
-    if students:
-        # Фильтрация студентов
-        filtered_students = [
-            student for student in students
-            if (not search or search.lower() in student["full_name"].lower() or search.lower() in student["username"].lower())
-            and (filter_group == "Все" or student["group"] == filter_group)
-        ]
-        
-        st.success(f"🎯 Найдено студентов: {len(filtered_students)}")
+    group = None if filter_group == "Все" else filter_group
 
-        # Отображение студентов
-        for i, student in enumerate(filtered_students):
-            with st.container():
-                col1, col2, col3 = st.columns([3, 2, 1])
-                with col1:
-                    st.write(f"### 🎓 {student['full_name']}")
-                    st.write(f"**Логин:** {student['username']}")
-                    st.write(f"**Группа:** {student['group']}")
-                    if student['email']:
-                        st.write(f"**Email:** {student['email']}")
-                with col2:
-                    st.write("**📊 Успеваемость**")
-                    st.write("Тестов пройдено: 0")  # TODO: Реальная статистика
-                    st.write("Средний балл: 0.0")
-                with col3:
-                    if st.button("👁️ Подробнее", key=f"view_{i}"):
-                        st.session_state[f"view_student_{i}"] = not st.session_state.get(f"view_student_{i}", False)
-                
-                if st.session_state.get(f"view_student_{i}"):
-                    with st.expander(f"📊 Детальная информация", expanded=True):
-                        show_student_details(student, i)
-                st.markdown("---")
-    else:
-        st.warning("📭 Пока нет зарегистрированных студентов")
+    # Курсоры просмотренных страниц; новый запрос начинает с первой
+    state_key = (search, filter_group, page_size)
+    if st.session_state.get("students_state_key") != state_key:
+        st.session_state.students_state_key = state_key
+        st.session_state.students_cursors = [None]
+    cursors = st.session_state.students_cursors
 
-def show_student_details(student: dict, index: int):
+    total = count_students(search, group)
+    if not total:
+        if search or group:
+            st.info("🔍 Никого не найдено")
+        else:
+            st.warning("📭 Пока нет зарегистрированных студентов")
+        return
+
+    page = search_students(search, group, limit=page_size, cursor=cursors[-1])
+    pages = (total + page_size - 1) // page_size
+    st.success(f"🎯 Найдено студентов: {total} · страница {len(cursors)} из {pages}")
+
+    # Успеваемость всей страницы одним запросом
+    page_statistics = get_students_statistics([student['username'] for student in page["rows"]])
+
+    # Отображение только текущей страницы
+    for student in page["rows"]:
+        username = student['username']
+        with st.container():
+            col1, col2, col3 = st.columns([3, 2, 1])
+            with col1:
+                st.write(f"### 🎓 {student['full_name']}")
+                st.write(f"**Логин:** {username}")
+                st.write(f"**Группа:** {student['group']}")
+                if student['email']:
+                    st.write(f"**Email:** {student['email']}")
+            stats = page_statistics[username]
+            with col2:
+                st.write("**📊 Успеваемость**")
+                st.write(f"Тестов пройдено: {stats['tests_completed']}")
+                st.write(f"Средний балл: {stats['avg_success_rate']}%")
+            with col3:
+                if st.button("👁️ Подробнее", key=f"view_{username}"):
+                    st.session_state[f"view_student_{username}"] = not st.session_state.get(f"view_student_{username}", False)
+            
+            if st.session_state.get(f"view_student_{username}"):
+                with st.expander(f"📊 Детальная информация", expanded=True):
+                    show_student_details(student, stats)
+            st.markdown("---")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("⬅️ Назад", key="students_prev", use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if page["next_cursor"] and st.button("Далее ➡️", key="students_next", use_container_width=True):
+            cursors.append(page["next_cursor"])
+            st.rerun()
+
+def show_student_details(student: dict, stats: dict):
     """Детальная информация о студенте"""
+    if stats['recent_attempts'] >= 8:
+        activity = "высокая"
+    elif stats['recent_attempts'] >= 3:
+        activity = "средняя"
+    elif stats['recent_attempts'] > 0:
+        activity = "низкая"
+    else:
+        activity = "нет за 30 дней"
+
     col1, col2 = st.columns(2)
     with col1:
         st.write("**📊 Статистика обучения**")
-        st.write("Пройдено тестов: 0")
-        st.write("Средний балл: 0.0")
-        st.write("Лучший результат: 0%")
-        st.write("Активность: низкая")
+        st.write(f"Пройдено тестов: {stats['tests_completed']} (попыток: {stats['attempts']})")
+        st.write(f"Средний балл: {stats['avg_success_rate']}%")
+        st.write(f"Лучший результат: {stats['best_success_rate']}%")
+        st.write(f"Активность: {activity}")
     with col2:
         st.write("**🎯 Последняя активность**")
-        st.write("Последний тест: нет данных")
-        st.write("Дата последнего входа: нет данных")
-        st.write("Всего времени в системе: нет данных")
+        st.write(f"Последний тест: {stats['last_test_title'] or 'нет данных'}")
+        st.write(f"Дата последнего теста: {stats['last_activity'] or 'нет данных'}")
+        st.write(f"Время в тестах: {stats['total_time_spent'] // 60} мин")
+    
+    st.write("**📈 Прогресс по неделям**")
+    progress = get_student_progress(student['username'], period="week")
+    if not progress:
+        st.info("📭 Студент еще не проходил тесты")
+        return
     
-    st.write("**📈 История тестов**")
-    st.info("Здесь будет история прохождения тестов")
+    fig = go.Figure()
+    if student.get('group'):
+        # Медиана и межквартильный коридор группы за те же недели
+        cohort = pd.DataFrame(get_group_progress(student['group'], period="week")['median'])
+        if not cohort.empty:
+            fig.add_trace(go.Scatter(x=cohort['date'], y=cohort['p75'], mode='lines',
+                                     line={'width': 0}, showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(x=cohort['date'], y=cohort['p25'], mode='lines', fill='tonexty',
+                                     line={'width': 0}, fillcolor='rgba(150, 150, 150, 0.2)',
+                                     name='25-75% группы'))
+            fig.add_trace(go.Scatter(x=cohort['date'], y=cohort['median'], mode='lines',
+                                     line={'dash': 'dash', 'color': 'gray'},
+                                     name=f"Медиана группы {student['group']}"))
+    fig.add_trace(go.Scatter(x=[item['date'] for item in progress], y=[item['daily_avg'] for item in progress],
+                             mode='lines+markers', name=student['full_name']))
+    fig.update_layout(xaxis_title="Неделя", yaxis_title="Средний процент (%)", height=350)
+    st.plotly_chart(fig, use_container_width=True, key=f"progress_{student['username']}")
 
 def show_tests_management():
     """Управление тестами"""
@@ -898,26 +1196,30 @@ def create_new_test(title: str, description: str, time_limit: int, max_attempts:
                    shuffle_questions: bool, show_results: bool, is_active: bool):
     """Создание нового теста"""
     try:
-        test_id = create_test(
+        questions = [
+            {
+                "question_text": question_data["text"],
+                "options": question_data["options"],
+                "correct_answers": question_data["correct_answers"],
+                "question_type": question_data["type"],
+                "points": question_data["points"],
+                "question_order": i
+            } for i, question_data in enumerate(st.session_state.test_questions)
+        ]
+
+        # Тест и все вопросы сохраняются одной транзакцией
+        test_id = create_test_with_questions(
             title=title,
             description=description,
+            questions=questions,
             time_limit=time_limit,
             max_attempts=max_attempts,
-            created_by=st.session_state.username
+            created_by=st.session_state.username,
+            shuffle_questions=shuffle_questions,
+            show_results=show_results,
+            is_active=is_active
         )
         
-        # Добавляем вопросы
-        for i, question_data in enumerate(st.session_state.test_questions):
-            create_secure_question(
-                test_id=test_id,
-                question_text=question_data["text"],
-                options=question_data["options"],
-                correct_answers=question_data["correct_answers"],
-                question_type=question_data["type"],
-                points=question_data["points"],
-                question_order=i
-            )
-        
         st.success(f"🎉 Тест '{title}' успешно создан! ID: {test_id}")
         cleanup_test_creation_state()
         st.rerun()
@@ -959,9 +1261,56 @@ def show_test_details(test: dict):
                         st.write(f" - {opt}")
                 
                 st.markdown("---")
+            
+            if questions:
+                show_regrade_controls(test, questions)
         except Exception as e:
             st.error(f"Ошибка при загрузке вопросов: {e}")
 
+def show_regrade_controls(test: dict, questions: list):
+    """Исправление ключа ответов и перепроверка прошлых результатов"""
+    st.markdown("#### 🔁 Исправление ключа и перепроверка")
+    question = st.selectbox("Вопрос", questions, format_func=lambda q: q['question_text'],
+                            key=f"regrade_question_{test['id']}")
+    if question['question_type'] == 'single_choice' and question['options']:
+        correct_answers = [st.radio("Правильный вариант", question['options'],
+                                    key=f"regrade_single_{question['id']}")]
+    elif question['options']:
+        correct_answers = st.multiselect("Правильные варианты", question['options'],
+                                         key=f"regrade_multi_{question['id']}")
+    else:
+        answer = st.text_input("Правильный ответ", key=f"regrade_text_{question['id']}")
+        correct_answers = [answer] if answer.strip() else []
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("💾 Сохранить ключ", key=f"save_key_{test['id']}", use_container_width=True):
+            if correct_answers and update_answer_key(question['id'], correct_answers):
+                st.success("✅ Ключ ответов обновлен. Перепроверьте прошлые результаты.")
+            else:
+                st.error("❌ Укажите правильный ответ")
+    with col2:
+        regrade = st.button("🔁 Перепроверить результаты", key=f"regrade_{test['id']}",
+                            use_container_width=True)
+    
+    if regrade:
+        progress_bar = st.progress(0.0, text="Перепроверка...")
+        # Пул процессов оставлен консольному regrade.py: сервер Streamlit не порождает процессы
+        report = regrade_test(test['id'], workers=1,
+                              progress=lambda done, total: progress_bar.progress(done / total, text=f"{done}/{total}"))
+        st.success(f"✅ Проверено результатов: {report['processed']}, изменилось: {len(report['changed'])}")
+        if report['changed']:
+            st.dataframe(
+                pd.DataFrame(report['changed'])[
+                    ['student_username', 'attempt_number', 'completed_at', 'old_score', 'new_score', 'new_max_score']
+                ].rename(columns={
+                    'student_username': 'Студент', 'attempt_number': 'Попытка', 'completed_at': 'Дата',
+                    'old_score': 'Было', 'new_score': 'Стало', 'new_max_score': 'Максимум'
+                }),
+                hide_index=True,
+                use_container_width=True
+            )
+
 def show_teacher_settings():
     """Настройки преподавателя"""
     st.markdown("### ⚙️ Настройки преподавателя")
@@ -981,6 +1330,28 @@ def show_teacher_settings():
         if st.form_submit_button("💾 Сохранить настройки", use_container_width=True):
             st.success("✅ Настройки успешно сохранены!")
 
+    with st.expander("🛠️ Состояние системы"):
+        st.write("**Очередь записи результатов**")
+        writer = get_writer_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("В очереди", writer['queue_depth'])
+        with col2:
+            st.metric("Записано за минуту", writer['throughput_per_min'])
+        with col3:
+            st.metric("Средний пакет", writer['avg_batch'], help=f"Максимум: {writer['max_batch']}")
+        with col4:
+            st.metric("Коммит, мс", writer['avg_commit_ms'], help=f"Ошибок записи: {writer['failed']}, "
+                                                                  f"не засчитано: {writer['rejected']}")
+
+        st.write("**Кеш чтения**")
+        cache = get_cache_stats()
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Попадания", f"{cache['hit_rate']}%")
+        with col2:
+            st.metric("Записей в кеше", f"{cache['size']}/{cache['maxsize']}")
+
 # ПАНЕЛЬ СТУДЕНТА
 def show_student_panel():
     """Основная панель студента"""
@@ -1032,18 +1403,25 @@ def show_available_tests_student():
                     st.write(f"_{test['description']}_")
                     st.write(f"Попытка: {test['current_attempt']} из {test['max_attempts']}")
                 with col2:
-                    questions = get_test_questions(test['id'])
-                    st.write(f"❓ {len(questions)} вопр.")
+                    st.write(f"❓ {test['question_count']} вопр.")
                 with col3:
                     st.write(f"⏱️ {test['time_limit']} мин.")
                 with col4:
                     if st.button("Начать тест", key=f"start_test_{test['id']}"):
-                        st.session_state.update({
-                            "current_test": test,
-                            "test_started": True,
-                            "test_start_time": time.time()
-                        })
-                        st.rerun()
+                        # Начало и дедлайн попытки фиксируются на сервере
+                        try:
+                            session = start_test_session(test['id'], st.session_state.username)
+                        except ValueError as e:
+                            st.error(f"❌ {e}")
+                        else:
+                            st.session_state.update({
+                                "current_test": test,
+                                "test_started": True,
+                                "test_session_id": session['id'],
+                                # Один токен на попытку: повторная отправка не создаст вторую попытку
+                                "submission_token": uuid.uuid4().hex
+                            })
+                            st.rerun()
                 st.markdown("---")
     except Exception as e:
         st.error(f"Ошибка при загрузке тестов: {e}")
@@ -1083,7 +1461,18 @@ def show_student_progress_interface():
     st.markdown("### 📈 Мой прогресс")
     
     try:
-        progress_data = get_student_progress(st.session_state.username)
+        periods = {"По дням": "day", "По неделям": "week", "По месяцам": "month"}
+        col1, col2 = st.columns(2)
+        with col1:
+            period = st.radio("Группировка", list(periods), horizontal=True, key="progress_period")
+        with col2:
+            date_range = st.date_input("Период", value=(), key="progress_range")
+        
+        # Пока выбрана только начальная дата, диапазон открыт справа
+        date_from = date_range[0].isoformat() if len(date_range) > 0 else None
+        date_to = date_range[1].isoformat() if len(date_range) > 1 else None
+        progress_data = get_student_progress(st.session_state.username, date_from, date_to,
+                                             period=periods[period])
         
         if not progress_data:
             st.info("📭 У вас пока нет данных о прогрессе")
@@ -1093,7 +1482,7 @@ def show_student_progress_interface():
         dates = [item['date'] for item in progress_data]
         daily_avg = [item['daily_avg'] for item in progress_data]
         
-        fig = px.line(x=dates, y=daily_avg, title="Прогресс успеваемости",
+        fig = px.line(x=dates, y=daily_avg, title="Прогресс успеваемости", markers=True,
                      labels={'x': 'Дата', 'y': 'Средний процент успеха (%)'})
         st.plotly_chart(fig, use_container_width=True)
         
@@ -1119,33 +1508,44 @@ def show_test_interface():
         return
     
     test = st.session_state.current_test
-    questions = get_test_questions(test['id'])
-    
-    # Таймер
-    elapsed_time = time.time() - st.session_state.test_start_time
-    remaining_time = (test['time_limit'] * 60) - elapsed_time
+    session = get_test_session(st.session_state.test_session_id)
     
-    if remaining_time <= 0:
-        handle_test_timeout(test, int(elapsed_time))
+    # Дедлайн хранится в БД: перезагрузка страницы таймер не сбрасывает
+    if not session or session['remaining'] <= 0:
+        handle_test_timeout(test, session)
         return
     
-    show_test_timer(remaining_time)
-    show_test_questions(test, questions, elapsed_time)
+    show_test_timer(session['deadline'])
+    questions = get_test_questions(test['id'])
+    show_test_questions(test, questions, session)
 
-def handle_test_timeout(test: dict, elapsed_time: int):
+def handle_test_timeout(test: dict, session: dict):
     """Обработка истечения времени теста"""
     st.error("⏰ Время вышло! Тест автоматически завершен.")
-    submit_test_answers(test['id'], st.session_state.username, {}, elapsed_time)
+    if session and session['status'] == 'active':
+        # Сессию еще не закрыла фоновая очистка - закрываем сами
+        try:
+            submit_test_answers(test['id'], st.session_state.username, {}, 
+                                int(session['deadline'] - session['started_at']), session_id=session['id'],
+                                submission_token=st.session_state.submission_token)
+        except SubmissionRejected:
+            # Сессию уже закрыла фоновая очистка или попытки исчерпаны - время вышло в любом случае
+            pass
     cleanup_test_session()
     st.rerun()
 
-def show_test_timer(remaining_time: int):
-    """Показывает таймер теста"""
+@st.fragment(run_every=1)
+def show_test_timer(deadline: float):
+    """Показывает таймер теста (обновляется отдельно от формы с вопросами)"""
+    remaining_time = deadline - time.time()
+    if remaining_time <= 0:
+        # Полный перезапуск скрипта завершит тест
+        st.rerun()
     minutes = int(remaining_time // 60)
     seconds = int(remaining_time % 60)
     st.warning(f"⏰ Осталось времени: {minutes:02d}:{seconds:02d}")
 
-def show_test_questions(test: dict, questions: list, elapsed_time: int):
+def show_test_questions(test: dict, questions: list, session: dict):
     """Показывает вопросы теста"""
     with st.form("test_form"):
         st.markdown(f"### {test['title']}")
@@ -1158,12 +1558,13 @@ def show_test_questions(test: dict, questions: list, elapsed_time: int):
         with col1:
             submitted = st.form_submit_button("✅ Завершить тест", use_container_width=True)
         with col2:
-            if st.form_submit_button("❌ Выйти", use_container_width=True):
+            if st.form_submit_button("❌ Выйти", use_container_width=True,
+                                     help="Время попытки продолжает идти - тест можно продолжить до дедлайна"):
                 cleanup_test_session()
                 st.rerun()
         
         if submitted:
-            handle_test_submission(test, answers, int(elapsed_time))
+            handle_test_submission(test, answers, session)
 
 def collect_answers(questions: list) -> dict:
     """Собирает ответы на вопросы"""
@@ -1187,23 +1588,27 @@ def collect_answers(questions: list) -> dict:
             answers[str(question['id'])] = answer
     return answers
 
-def handle_test_submission(test: dict, answers: dict, elapsed_time: int):
+def handle_test_submission(test: dict, answers: dict, session: dict):
     """Обрабатывает отправку теста"""
-    score, max_score = submit_test_answers(test['id'], st.session_state.username, answers, elapsed_time)
-    st.session_state.update({
-        "test_started": False,
-        "last_test_result": {
-            'score': score,
-            'max_score': max_score,
-            'test_title': test['title']
-        }
-    })
-    del st.session_state.current_test
+    # Затраченное время пересчитывается на сервере по данным сессии
+    elapsed_time = int(time.time() - session['started_at'])
+    try:
+        score, max_score = submit_test_answers(test['id'], st.session_state.username, answers, 
+                                               elapsed_time, session_id=session['id'],
+                                               submission_token=st.session_state.submission_token)
+        result = {'score': score, 'max_score': max_score, 'test_title': test['title']}
+    except SubmissionRejected as e:
+        # Ответы не засчитаны - показываем причину вместо результата
+        result = {'rejected': str(e), 'test_title': test['title']}
+    cleanup_test_session()
+    st.session_state.last_test_result = result
     st.rerun()
 
 def cleanup_test_session():
     """Очистка сессии теста"""
     st.session_state.test_started = False
+    st.session_state.test_session_id = None
+    st.session_state.submission_token = None
     if "current_test" in st.session_state:
         del st.session_state.current_test
 
@@ -1213,6 +1618,13 @@ def show_test_result():
         return
         
     result = st.session_state.last_test_result
+    if result.get('rejected'):
+        st.warning(f"⚠️ Тест '{result['test_title']}': {result['rejected']}")
+        if st.button("Вернуться к списку тестов"):
+            del st.session_state.last_test_result
+            st.rerun()
+        return
+
     percentage = (result['score'] / result['max_score']) * 100
     
     st.balloons()
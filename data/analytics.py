@@ -0,0 +1,199 @@
+"""Аналитика результатов на pandas/NumPy: одна выборка на запрос, все показатели векторно"""
+from typing import Optional, List, Dict, Sequence
+
+import numpy as np
+import pandas as pd
+
+from data.db_manager import DatabaseManager, GRADE_RANGES, read_cache, routed
+
+# Перцентили процента выполнения, которые показывает дашборд
+PERCENTILES = (25, 50, 75, 90)
+
+
+# =============================================================================
+# ЗАГРУЗКА ДАННЫХ
+# =============================================================================
+
+@routed
+def load_results_frame(created_by: Optional[str] = None) -> pd.DataFrame:
+    """Все попытки (и студенты без попыток) одной таблицей для всех вкладок дашборда.
+
+    Строка студента без попыток имеет пустой result_id - она нужна для численности групп.
+    created_by ограничивает попытки тестами одного преподавателя.
+    Выборка перечитывается только после изменения результатов или состава пользователей.
+    """
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT (SELECT value FROM stats_meta WHERE name = 'results_version'),
+                            (SELECT COUNT(*) FROM users)""")
+        version = tuple(c.fetchone())
+
+    # Одна запись на преподавателя: новая версия данных заменяет прежнюю выборку
+    key = ("results_frame", created_by)
+    found, entry = read_cache.get(key)
+    if not found or entry[0] != version:
+        entry = (version, _query_results_frame(created_by))
+        read_cache.set(key, entry)
+    # Мелкая копия без копирования данных: новые столбцы вызывающего не попадают в кеш
+    return entry[1].copy(deep=False)
+
+
+def _query_results_frame(created_by: Optional[str]) -> pd.DataFrame:
+    """Выборка попыток из БД (без кеша)"""
+    test_filter = "AND t.created_by = ?" if created_by is not None else ""
+    params = (created_by,) if created_by is not None else ()
+
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""
+            SELECT
+                r.id as result_id,
+                r.test_id,
+                t.title as test_title,
+                r.student_username,
+                u.full_name,
+                CASE WHEN u.role = 'Студент' AND u.group_name <> '' THEN u.group_name END as group_name,
+                r.score,
+                r.max_score,
+                r.time_spent,
+                r.completed_at,
+                r.attempt_number
+            FROM test_results r
+            JOIN tests t ON t.id = r.test_id {test_filter}
+            LEFT JOIN users u ON u.username = r.student_username
+            UNION ALL
+            SELECT NULL, NULL, NULL, u.username, u.full_name, u.group_name,
+                   NULL, NULL, NULL, NULL, NULL
+            FROM users u
+            WHERE u.role = 'Студент' AND u.group_name IS NOT NULL AND u.group_name <> ''
+              AND NOT EXISTS (SELECT 1 FROM test_results r
+                              JOIN tests t ON t.id = r.test_id {test_filter}
+                              WHERE r.student_username = u.username)
+        """, params + params)
+        columns = [column[0] for column in c.description]
+        frame = pd.DataFrame.from_records(c.fetchall(), columns=columns)
+
+    frame["completed_at"] = pd.to_datetime(frame["completed_at"])
+    # Целочисленные столбцы с пропусками (строки студентов без попыток)
+    for column in ("result_id", "test_id", "attempt_number"):
+        frame[column] = frame[column].astype("Int64")
+    for column in ("score", "max_score", "time_spent"):
+        frame[column] = pd.to_numeric(frame[column])
+    # Процент выполнения попытки; без max_score - NaN, как NULL в SQL
+    frame["percent"] = frame["score"] * 100.0 / frame["max_score"].where(frame["max_score"] > 0)
+    return frame
+
+
+def attempts(frame: pd.DataFrame) -> pd.DataFrame:
+    """Только строки попыток (без студентов, не проходивших тесты)"""
+    return frame[frame["result_id"].notna()]
+
+
+# =============================================================================
+# РАСПРЕДЕЛЕНИЯ И ПЕРЦЕНТИЛИ
+# =============================================================================
+
+def grade_bins(step: Optional[int] = None) -> Dict[str, List[float]]:
+    """Границы диапазонов: оценки GRADE_RANGES или равные интервалы по step процентов"""
+    if step is None:
+        edges = [low for _, low in GRADE_RANGES] + [np.inf]
+        return {"edges": edges, "labels": [label for label, _ in GRADE_RANGES]}
+    lows = list(range(0, 100, step))
+    labels = [f"{low}-{low + step - 1}%" for low in lows[:-1]] + [f"{lows[-1]}-100%"]
+    return {"edges": lows + [np.inf], "labels": labels}
+
+
+def grade_distribution(frame: pd.DataFrame, step: Optional[int] = None,
+                       keep_empty: bool = False) -> pd.Series:
+    """Количество попыток в каждом диапазоне процента выполнения"""
+    bins = grade_bins(step)
+    # Как и в сводных таблицах, попытка без max_score попадает в нижний диапазон
+    percent = attempts(frame)["percent"].fillna(0).clip(lower=0)
+    counts = pd.cut(percent, bins["edges"], labels=bins["labels"], right=False).value_counts(sort=False)
+    return counts if keep_empty else counts[counts > 0]
+
+
+def percentile_summary(frame: pd.DataFrame, column: str = "percent",
+                       percentiles: Sequence[int] = PERCENTILES) -> Dict[str, float]:
+    """Среднее, медиана, разброс и перцентили столбца по всем попыткам"""
+    values = attempts(frame)[column].dropna().to_numpy(dtype=float)
+    if values.size == 0:
+        return {"count": 0, "mean": 0.0, "median": 0.0, "std": 0.0, "min": 0.0, "max": 0.0,
+                **{f"p{p}": 0.0 for p in percentiles}}
+    summary = {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 1),
+        "median": round(float(np.median(values)), 1),
+        "std": round(float(values.std(ddof=0)), 1),
+        "min": round(float(values.min()), 1),
+        "max": round(float(values.max()), 1),
+    }
+    for p, value in zip(percentiles, np.percentile(values, percentiles)):
+        summary[f"p{p}"] = round(float(value), 1)
+    return summary
+
+
+# =============================================================================
+# СВОДНЫЕ ТАБЛИЦЫ ПО ГРУППАМ, ТЕСТАМ И СТУДЕНТАМ
+# =============================================================================
+
+def group_summary(frame: pd.DataFrame) -> pd.DataFrame:
+    """Метрики по группам: численность, тесты, попытки, средний/медианный/лучший/худший %"""
+    grouped = frame[frame["group_name"].notna()]
+    students = grouped.groupby("group_name")["student_username"].nunique().rename("student_count")
+    summary = attempts(grouped).groupby("group_name").agg(
+        total_tests=("test_id", "nunique"),
+        total_attempts=("result_id", "count"),
+        avg_success_rate=("percent", "mean"),
+        median_success_rate=("percent", "median"),
+        max_success_rate=("percent", "max"),
+        min_success_rate=("percent", "min"),
+    )
+    summary = pd.concat([students, summary], axis=1).fillna(0).sort_index()
+    summary[["total_tests", "total_attempts"]] = summary[["total_tests", "total_attempts"]].astype(int)
+    return summary.round(1)
+
+
+def test_summary(frame: pd.DataFrame) -> pd.DataFrame:
+    """Метрики по тестам: попытки, баллы, проценты, время и межквартильный размах"""
+    summary = attempts(frame).groupby(["test_id", "test_title"]).agg(
+        total_attempts=("result_id", "count"),
+        students=("student_username", "nunique"),
+        avg_score=("score", "mean"),
+        max_score_achieved=("score", "max"),
+        min_score_achieved=("score", "min"),
+        avg_time_spent=("time_spent", "mean"),
+        avg_success_rate=("percent", "mean"),
+        median_success_rate=("percent", "median"),
+        p25_success_rate=("percent", lambda values: values.quantile(0.25)),
+        p75_success_rate=("percent", lambda values: values.quantile(0.75)),
+    )
+    return summary.reset_index(level="test_title").round(1)
+
+
+def student_summary(frame: pd.DataFrame) -> pd.DataFrame:
+    """Средний и лучший % каждого студента"""
+    return attempts(frame).groupby("student_username").agg(
+        group_name=("group_name", "first"),
+        tests_completed=("result_id", "count"),
+        avg_success_rate=("percent", "mean"),
+        best_success_rate=("percent", "max"),
+    ).round(1)
+
+
+def group_test_pivot(frame: pd.DataFrame, value: str = "percent", aggfunc: str = "mean") -> pd.DataFrame:
+    """Сводная таблица группа x тест (по умолчанию - средний %)"""
+    grouped = attempts(frame[frame["group_name"].notna()])
+    if grouped.empty:
+        return pd.DataFrame()
+    return grouped.pivot_table(index="group_name", columns="test_title", values=value,
+                               aggfunc=aggfunc).round(1)
+
+
+def activity_series(frame: pd.DataFrame, freq: str = "D") -> pd.DataFrame:
+    """Временной ряд: число попыток и средний % за каждый период (D - день, W - неделя, MS - месяц)"""
+    timeline = attempts(frame).set_index("completed_at").sort_index()
+    if timeline.empty:
+        return pd.DataFrame(columns=["attempts", "avg_success_rate"])
+    series = timeline.resample(freq).agg({"result_id": "count", "percent": "mean"})
+    return series.rename(columns={"result_id": "attempts", "percent": "avg_success_rate"}).round(1)
@@ -3,190 +3,1186 @@ import bcrypt
 import os
 import hashlib
 import json
-from typing import Optional, List, Dict, Any
+import csv
+import io
+import codecs
+import copy
+import inspect
+import time
+import threading
+import queue
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial, wraps
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterator, Callable, Tuple, BinaryIO
 
 DB_PATH = "data/users.db"
 
+# Максимум параметров в одном списке IN (...) - запас до лимита SQLite
+SQL_IN_CHUNK = 900
+
+# Политика хеширования паролей: стоимость bcrypt и размер пула проверки паролей
+BCRYPT_ROUNDS = int(os.environ.get("DBLEARN_BCRYPT_ROUNDS", 12))
+AUTH_WORKERS = int(os.environ.get("DBLEARN_AUTH_WORKERS", 4))
+AUTH_TIMEOUT = 30  # сек ожидания свободного обработчика
+
+# Кеш чтения: максимум записей и время жизни записи в секундах
+CACHE_MAXSIZE = int(os.environ.get("DBLEARN_CACHE_MAXSIZE", 2048))
+CACHE_TTL = float(os.environ.get("DBLEARN_CACHE_TTL", 300))
+
+# Как часто (сек) проверять, не устарел ли снимок рейтинга
+RANKING_REFRESH_INTERVAL = float(os.environ.get("DBLEARN_RANKING_REFRESH", 30))
+
+# Сессии тестирования: запас (сек) на доставку ответов после дедлайна и период фоновой очистки
+SESSION_GRACE_PERIOD = float(os.environ.get("DBLEARN_SESSION_GRACE", 5))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("DBLEARN_SESSION_SWEEP", 15))
+
+# Перепроверка результатов: сколько попыток читается, проверяется и записывается за раз
+REGRADE_CHUNK = int(os.environ.get("DBLEARN_REGRADE_CHUNK", 500))
+
+# Выгрузка результатов: строк на один fetchmany
+EXPORT_BATCH_SIZE = int(os.environ.get("DBLEARN_EXPORT_BATCH", 1000))
+
+# Очередь записи результатов: максимум отправок в одной транзакции и ожидание подтверждения
+WRITER_BATCH_SIZE = int(os.environ.get("DBLEARN_WRITER_BATCH", 200))
+SUBMIT_TIMEOUT = 30  # сек
+
+# Профиль соединений SQLite (можно переопределить через DatabaseManager.configure)
+DB_PROFILE = {
+    "journal_mode": "WAL",        # читатели не блокируют писателя
+    "busy_timeout": 5000,         # мс ожидания блокировки вместо "database is locked"
+    "synchronous": "NORMAL",      # в режиме WAL безопасно и без fsync на каждый коммит
+    "cache_size": -16000,         # отрицательное значение - размер в КиБ
+    "mmap_size": 128 * 1024 * 1024,
+    "cached_statements": 256,     # кеш подготовленных выражений на соединение
+    "pool_size": 8,               # сколько простаивающих соединений держать открытыми
+    "query_only": False,          # PRAGMA query_only - запрет записи через соединение
+}
+
+# Профиль пула аналитики: только чтение и собственный, больший кеш страниц.
+# Долгие агрегаты отчетов не занимают соединения, через которые пишутся результаты
+ANALYTICS_PROFILE = {
+    **DB_PROFILE,
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "pool_size": 4,
+    "query_only": True,
+}
+
+# Из какого пула читает функция, помеченная @routed (имя функции -> имя пула).
+# Переопределение: DBLEARN_READ_ROUTES="get_leaderboard=default,get_student_progress=analytics"
+READ_ROUTES: Dict[str, str] = {
+    "get_all_students": "default",
+    "search_students": "default",
+    "count_students": "default",
+    "get_student_groups": "default",
+    "get_students_statistics": "analytics",
+    "get_student_progress": "analytics",
+    "get_group_progress": "analytics",
+    "iter_results_export": "analytics",  # генератор: пул берется явно, не через @routed
+    "get_leaderboard": "analytics",
+    "get_ranking_groups": "analytics",
+    "get_teacher_dashboard_stats": "analytics",
+    "get_question_statistics": "analytics",
+    "get_option_statistics": "analytics",
+    "load_results_frame": "analytics",  # data/analytics.py
+    "get_item_analysis": "analytics",  # data/item_analysis.py
+}
+READ_ROUTES.update(
+    (name.strip(), pool.strip())
+    for name, pool in (route.split("=", 1)
+                       for route in os.environ.get("DBLEARN_READ_ROUTES", "").split(",") if "=" in route)
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Соединение пула, помнящее путь к своей БД и имя пула"""
+    db_path: str = ""
+    pool: str = "default"
+
 
 class DatabaseManager:
-    """Менеджер для работы с базой данных"""
-    
-    @staticmethod
-    def get_connection():
-        """Создает и возвращает соединение с БД"""
-        os.makedirs("data", exist_ok=True)
-        return sqlite3.connect(DB_PATH)
+    """Менеджер для работы с базой данных (пулы соединений)"""
+
+    # "default" - чтение и запись, "analytics" - только чтение для отчетов
+    profiles: Dict[str, Dict[str, Any]] = {
+        "default": dict(DB_PROFILE),
+        "analytics": dict(ANALYTICS_PROFILE),
+    }
+    profile = profiles["default"]
+    _idle: Dict[str, List[PooledConnection]] = {}
+    _lock = threading.Lock()
+    _local = threading.local()
+
+    @classmethod
+    def configure(cls, pool: str = "default", **profile):
+        """Изменяет профиль соединений пула и сбрасывает пул"""
+        unknown = set(profile) - set(DB_PROFILE)
+        if unknown:
+            raise ValueError(f"Неизвестные параметры профиля: {', '.join(sorted(unknown))}")
+        cls.profiles.setdefault(pool, dict(DB_PROFILE)).update(profile)
+        cls.close_all()
+
+    @classmethod
+    def get_connection(cls, pool: str = "default") -> PooledConnection:
+        """Создает и возвращает новое настроенное соединение с БД"""
+        directory = os.path.dirname(DB_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        profile = cls.profiles[pool]
+        conn = sqlite3.connect(
+            DB_PATH,
+            timeout=profile["busy_timeout"] / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=profile["cached_statements"],
+            factory=PooledConnection,
+        )
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+        conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+        conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+        conn.execute(f"PRAGMA query_only = {'ON' if profile['query_only'] else 'OFF'}")
+        conn.db_path = DB_PATH
+        conn.pool = pool
+        return conn
+
+    @classmethod
+    def _acquire(cls, pool: str) -> PooledConnection:
+        """Берет соединение из пула или открывает новое"""
+        with cls._lock:
+            idle = cls._idle.setdefault(pool, [])
+            while idle:
+                conn = idle.pop()
+                if conn.db_path == DB_PATH:
+                    return conn
+                conn.close()
+        return cls.get_connection(pool)
+
+    @classmethod
+    def _release(cls, conn: PooledConnection):
+        """Возвращает соединение в пул"""
+        if conn.in_transaction:
+            conn.rollback()
+        with cls._lock:
+            idle = cls._idle.setdefault(conn.pool, [])
+            if conn.db_path == DB_PATH and len(idle) < cls.profiles[conn.pool]["pool_size"]:
+                idle.append(conn)
+                return
+        conn.close()
+
+    @classmethod
+    @contextmanager
+    def connection(cls, pool: Optional[str] = None) -> Iterator[PooledConnection]:
+        """Соединение, закрепленное за текущим потоком на время блока.
+
+        Вложенные вызовы в том же потоке получают то же соединение,
+        поэтому функции модуля можно свободно вызывать друг из друга.
+        Без явного pool берется пул текущей функции @routed, иначе "default".
+        """
+        pool = pool or getattr(cls._local, "route", None) or "default"
+        pinned = cls._local.__dict__.setdefault("pinned", {})
+        if pool in pinned:
+            pinned[pool][1] += 1
+            try:
+                yield pinned[pool][0]
+            finally:
+                pinned[pool][1] -= 1
+            return
+
+        conn = cls._acquire(pool)
+        pinned[pool] = [conn, 1]
+        try:
+            yield conn
+        finally:
+            del pinned[pool]
+            cls._release(conn)
+
+    @classmethod
+    @contextmanager
+    def snapshot(cls, pool: str) -> Iterator[PooledConnection]:
+        """Чтение из пула одним снимком WAL: все запросы блока видят одни и те же данные"""
+        with cls.connection(pool) as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+
+            # Отложенный BEGIN: снимок фиксируется первым чтением
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
+    @classmethod
+    @contextmanager
+    def transaction(cls, immediate: bool = False) -> Iterator[PooledConnection]:
+        """Транзакция: COMMIT при успехе, ROLLBACK при исключении.
+
+        immediate=True сразу захватывает блокировку записи (BEGIN IMMEDIATE).
+        Вложенная транзакция выполняется внутри внешней.
+        """
+        # Запись всегда идет через основной пул, даже внутри функции аналитики
+        with cls.connection("default") as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    @classmethod
+    def close_all(cls):
+        """Закрывает все простаивающие соединения пулов"""
+        with cls._lock:
+            idle, cls._idle = cls._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
+# Опечатка в DBLEARN_READ_ROUTES должна остановить запуск, а не первый отчет
+_unknown_routes = {name: pool for name, pool in READ_ROUTES.items() if pool not in DatabaseManager.profiles}
+if _unknown_routes:
+    raise ValueError("DBLEARN_READ_ROUTES: неизвестный пул в "
+                     + ", ".join(f"{name}={pool}" for name, pool in sorted(_unknown_routes.items()))
+                     + f" (доступны: {', '.join(DatabaseManager.profiles)})")
+
+
+def routed(func):
+    """Выполняет функцию чтения на пуле из READ_ROUTES (по умолчанию - основной пул)"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        pool = READ_ROUTES.get(func.__name__, "default")
+        previous = getattr(DatabaseManager._local, "route", None)
+        DatabaseManager._local.route = pool
+        try:
+            if pool == "default":
+                # Основной пул без снимка: внутри может быть запись (например, пересчет рейтинга)
+                return func(*args, **kwargs)
+            with DatabaseManager.snapshot(pool):
+                return func(*args, **kwargs)
+        finally:
+            DatabaseManager._local.route = previous
+    return wrapper
 
 
 def init_db():
     """Инициализация базы данных и создание таблиц"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
+    with DatabaseManager.transaction() as conn:
+        c = conn.cursor()
+
+        # Таблица пользователей
+        c.execute('''CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL,
+            full_name TEXT,
+            group_name TEXT,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+        # Таблица тестов
+        c.execute('''CREATE TABLE IF NOT EXISTS tests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            time_limit INTEGER DEFAULT 60,
+            max_attempts INTEGER DEFAULT 1,
+            shuffle_questions BOOLEAN DEFAULT TRUE,
+            show_results BOOLEAN DEFAULT FALSE,
+            created_by TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )''')
+
+        # Таблица вопросов
+        c.execute('''CREATE TABLE IF NOT EXISTS test_questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_id INTEGER,
+            question_text TEXT NOT NULL,
+            question_type TEXT DEFAULT 'single_choice',
+            options JSON,
+            points INTEGER DEFAULT 1,
+            question_order INTEGER,
+            FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE
+        )''')
+
+        # Таблица правильных ответов
+        c.execute('''CREATE TABLE IF NOT EXISTS test_answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_id INTEGER,
+            correct_answers JSON NOT NULL,
+            answer_hash TEXT NOT NULL,
+            FOREIGN KEY (question_id) REFERENCES test_questions (id) ON DELETE CASCADE
+        )''')
+
+        # Таблица результатов
+        c.execute('''CREATE TABLE IF NOT EXISTS test_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_id INTEGER,
+            student_username TEXT,
+            answers JSON,
+            score INTEGER,
+            max_score INTEGER,
+            time_spent INTEGER,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            attempt_number INTEGER,
+            FOREIGN KEY (test_id) REFERENCES tests (id),
+            FOREIGN KEY (student_username) REFERENCES users (username)
+        )''')
+
+    migrate_db()
+    create_default_teacher()
+
+
+def create_default_teacher():
+    """Создает преподавателя по умолчанию"""
+    with DatabaseManager.transaction() as conn:
+        c = conn.cursor()
+
+        c.execute("SELECT username FROM users WHERE username = ?", ("teacher",))
+        if not c.fetchone():
+            hashed_password = _hash_password("10209065")
+
+            c.execute("""INSERT INTO users (username, password, role, full_name, group_name, email) 
+                         VALUES (?, ?, ?, ?, ?, ?)""",
+                      ("teacher", hashed_password, "Преподаватель", "Преподаватель", "ИТ-преподаватели", "teacher@college.ru"))
+            print("✅ Преподаватель teacher создан")
+
+
+# =============================================================================
+# МИГРАЦИИ СХЕМЫ
+# =============================================================================
 
-    # Таблица пользователей
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
+# Версия схемы хранится в PRAGMA user_version; миграции применяются по порядку
+SCHEMA_MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = []
+
+
+def migration(version: int, description: str):
+    """Регистрирует функцию миграции схемы до указанной версии"""
+    def register(func: Callable[[sqlite3.Cursor], None]):
+        if any(existing[0] == version for existing in SCHEMA_MIGRATIONS):
+            raise ValueError(f"Миграция {version} уже зарегистрирована")
+        SCHEMA_MIGRATIONS.append((version, description, func))
+        SCHEMA_MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+def get_schema_version() -> int:
+    """Текущая версия схемы БД"""
+    with DatabaseManager.connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_db() -> int:
+    """Применяет недостающие миграции и обновляет статистику планировщика"""
+    with DatabaseManager.connection() as conn:
+        version = get_schema_version()
+        pending = [item for item in SCHEMA_MIGRATIONS if item[0] > version]
+
+        for target, description, apply in pending:
+            # Каждая миграция - отдельная транзакция вместе с новой версией схемы
+            with DatabaseManager.transaction(immediate=True):
+                # Версию перечитываем под блокировкой: миграцию мог применить другой процесс
+                if get_schema_version() >= target:
+                    continue
+                apply(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+            print(f"🛠️ Миграция схемы {target}: {description}")
+
+        if pending:
+            conn.execute("ANALYZE")
+
+        return get_schema_version()
+
+
+@migration(1, "индексы для частых запросов к результатам, вопросам и ответам")
+def _migrate_hot_query_indexes(c: sqlite3.Cursor):
+    # Попытки студента по тесту: get_available_tests, submit_test_answers
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_results_student_test
+                 ON test_results (student_username, test_id, attempt_number)""")
+    # История студента по дате: get_test_results, get_student_progress
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_results_student_completed
+                 ON test_results (student_username, completed_at)""")
+    # Аналитика по тесту: get_question_statistics, get_item_analysis
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_results_test
+                 ON test_results (test_id, score, max_score)""")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_questions_test_order
+                 ON test_questions (test_id, question_order)""")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_answers_question
+                 ON test_answers (question_id)""")
+    # Студенты группы: get_group_progress, get_all_students
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_users_role_group
+                 ON users (role, group_name)""")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_tests_created_by
+                 ON tests (created_by, created_at)""")
+
+
+# Сводные таблицы в том виде, в каком их создает миграция 2. Спецификации миграций
+# не меняются задним числом: новая форма таблицы или триггеров - новая миграция
+# со своей копией, иначе повторное применение v0 -> vN дало бы другую схему.
+# keys: (столбец, выражение по строке r/u, выражение для строки NEW/OLD триггера)
+# measures: (столбец, агрегат, способ слияния при вставке: sum/max/min);
+# агрегат None - число попыток в диапазоне grade_ranges с номером из имени столбца
+_SUMMARY_TABLES_V2: Dict[str, Dict[str, Any]] = {
+    "stats_test": {
+        "source": "test_results r",
+        "keys": [("test_id", "r.test_id", "{row}.test_id")],
+        "measures": [
+            ("attempts", "COUNT(*)", "sum"),
+            ("total_score", "SUM(r.score)", "sum"),
+            ("best_score", "MAX(r.score)", "max"),
+            ("worst_score", "MIN(r.score)", "min"),
+            ("time_sum", "SUM(r.time_spent)", "sum"),
+            ("time_count", "COUNT(r.time_spent)", "sum"),
+            ("percent_sum", "SUM(r.score * 100.0 / r.max_score)", "sum"),
+            ("percent_count", "COUNT(r.score * 100.0 / r.max_score)", "sum"),
+        ] + [(f"grade_{i}", None, "sum") for i in range(5)],
+        "percent": "(r.score * 100.0 / r.max_score)",
+        "grade_ranges": [0, 60, 70, 80, 90],
+    },
+    "stats_student": {
+        "source": "test_results r",
+        "keys": [("student_username", "r.student_username", "{row}.student_username")],
+        "measures": [
+            ("attempts", "COUNT(*)", "sum"),
+            ("total_score", "SUM(r.score)", "sum"),
+            ("percent_sum", "SUM(r.score * 100.0 / r.max_score)", "sum"),
+            ("percent_count", "COUNT(r.score * 100.0 / r.max_score)", "sum"),
+            ("best_percent", "MAX(r.score * 100.0 / r.max_score)", "max"),
+            ("last_completed_at", "MAX(r.completed_at)", "max"),
+        ],
+        "extra_columns": [
+            "avg_percent REAL GENERATED ALWAYS AS (percent_sum / NULLIF(percent_count, 0)) VIRTUAL",
+        ],
+        "indexes": ["(avg_percent DESC)"],
+    },
+    "stats_student_day": {
+        "source": "test_results r",
+        "keys": [
+            ("student_username", "r.student_username", "{row}.student_username"),
+            ("day", "DATE(r.completed_at)", "DATE({row}.completed_at)"),
+        ],
+        "measures": [
+            ("attempts", "COUNT(*)", "sum"),
+            ("percent_sum", "SUM(r.score * 100.0 / r.max_score)", "sum"),
+            ("percent_count", "COUNT(r.score * 100.0 / r.max_score)", "sum"),
+        ],
+    },
+    "stats_group": {
+        "source": """test_results r JOIN users u ON u.username = r.student_username
+                     AND u.role = 'Студент' AND u.group_name IS NOT NULL AND u.group_name <> ''""",
+        "keys": [("group_name", "u.group_name",
+                  "(SELECT group_name FROM users WHERE username = {row}.student_username)")],
+        "measures": [
+            ("attempts", "COUNT(*)", "sum"),
+            ("percent_sum", "SUM(r.score * 100.0 / r.max_score)", "sum"),
+            ("percent_count", "COUNT(r.score * 100.0 / r.max_score)", "sum"),
+            ("best_percent", "MAX(r.score * 100.0 / r.max_score)", "max"),
+            ("worst_percent", "MIN(r.score * 100.0 / r.max_score)", "min"),
+        ] + [(f"grade_{i}", None, "sum") for i in range(5)],
+        "percent": "(r.score * 100.0 / r.max_score)",
+        "grade_ranges": [0, 60, 70, 80, 90],
+    },
+    "stats_group_test": {
+        "source": """test_results r JOIN users u ON u.username = r.student_username
+                     AND u.role = 'Студент' AND u.group_name IS NOT NULL AND u.group_name <> ''""",
+        "keys": [
+            ("group_name", "u.group_name",
+             "(SELECT group_name FROM users WHERE username = {row}.student_username)"),
+            ("test_id", "r.test_id", "{row}.test_id"),
+        ],
+        "measures": [("attempts", "COUNT(*)", "sum")],
+    },
+}
+
+
+@migration(2, "сводные таблицы статистики с триггерами")
+def _migrate_summary_tables(c: sqlite3.Cursor):
+    for table, spec in _SUMMARY_TABLES_V2.items():
+        for statement in _summary_schema_sql(table, spec):
+            c.execute(statement)
+        c.execute(f"INSERT INTO {table} ({_summary_columns(spec)}) {_summary_select(spec, '1')}")
+
+
+@migration(3, "счетчики вопросов и баллов в таблице tests")
+def _migrate_test_question_counters(c: sqlite3.Cursor):
+    c.execute("ALTER TABLE tests ADD COLUMN question_count INTEGER NOT NULL DEFAULT 0")
+    c.execute("ALTER TABLE tests ADD COLUMN total_points INTEGER NOT NULL DEFAULT 0")
+    c.execute("""UPDATE tests SET
+                     question_count = (SELECT COUNT(*) FROM test_questions q WHERE q.test_id = tests.id),
+                     total_points = (SELECT COALESCE(SUM(points), 0) FROM test_questions q WHERE q.test_id = tests.id)""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_test_questions_count_insert
+                 AFTER INSERT ON test_questions BEGIN
+                     UPDATE tests SET question_count = question_count + 1,
+                                      total_points = total_points + COALESCE(NEW.points, 0)
+                     WHERE id = NEW.test_id;
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_test_questions_count_delete
+                 AFTER DELETE ON test_questions BEGIN
+                     UPDATE tests SET question_count = question_count - 1,
+                                      total_points = total_points - COALESCE(OLD.points, 0)
+                     WHERE id = OLD.test_id;
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_test_questions_count_update
+                 AFTER UPDATE OF test_id, points ON test_questions BEGIN
+                     UPDATE tests SET question_count = question_count - 1,
+                                      total_points = total_points - COALESCE(OLD.points, 0)
+                     WHERE id = OLD.test_id;
+                     UPDATE tests SET question_count = question_count + 1,
+                                      total_points = total_points + COALESCE(NEW.points, 0)
+                     WHERE id = NEW.test_id;
+                 END""")
+
+
+@migration(4, "снимок рейтинга студентов и версия данных результатов")
+def _migrate_ranking_snapshot(c: sqlite3.Cursor):
+    c.execute("""CREATE TABLE IF NOT EXISTS stats_meta (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )""")
+    c.execute("INSERT OR IGNORE INTO stats_meta (name, value) VALUES ('results_version', 0), ('ranking_version', -1)")
+
+    # Любое изменение результатов или групп студентов делает снимок рейтинга устаревшим
+    bump = "UPDATE stats_meta SET value = value + 1 WHERE name = 'results_version';"
+    for event in ("INSERT", "DELETE", "UPDATE"):
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_test_results_version_{event.lower()}
+                      AFTER {event} ON test_results BEGIN {bump} END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_users_version_update
+                  AFTER UPDATE OF group_name, role, full_name ON users BEGIN {bump} END""")
+
+    c.execute("""CREATE TABLE IF NOT EXISTS ranking_snapshot (
         username TEXT PRIMARY KEY,
-        password TEXT NOT NULL,
-        role TEXT NOT NULL,
         full_name TEXT,
         group_name TEXT,
-        email TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-
-    # Таблица тестов
-    c.execute('''CREATE TABLE IF NOT EXISTS tests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT,
-        time_limit INTEGER DEFAULT 60,
-        max_attempts INTEGER DEFAULT 1,
-        shuffle_questions BOOLEAN DEFAULT TRUE,
-        show_results BOOLEAN DEFAULT FALSE,
-        created_by TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        is_active BOOLEAN DEFAULT TRUE
-    )''')
-
-    # Таблица вопросов
-    c.execute('''CREATE TABLE IF NOT EXISTS test_questions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        test_id INTEGER,
-        question_text TEXT NOT NULL,
-        question_type TEXT DEFAULT 'single_choice',
-        options JSON,
-        points INTEGER DEFAULT 1,
-        question_order INTEGER,
-        FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE
-    )''')
-
-    # Таблица правильных ответов
-    c.execute('''CREATE TABLE IF NOT EXISTS test_answers (
+        tests_completed INTEGER,
+        avg_percent REAL,
+        total_points INTEGER,
+        global_rank INTEGER NOT NULL,
+        group_rank INTEGER NOT NULL
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ranking_snapshot_global ON ranking_snapshot (global_rank, username)")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_ranking_snapshot_group
+                 ON ranking_snapshot (group_name, group_rank, username)""")
+
+
+@migration(5, "полнотекстовый поиск по пользователям (FTS5)")
+def _migrate_users_search(c: sqlite3.Cursor):
+    # Индекс рассчитан на rowid таблицы users: после VACUUM нужен rebuild_search_index()
+    c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, full_name, email, group_name,
+        content = 'users',
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""")
+    fields = "username, full_name, email, group_name"
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users BEGIN
+                      INSERT INTO users_fts (rowid, {fields})
+                      VALUES (NEW.rowid, NEW.username, NEW.full_name, NEW.email, NEW.group_name);
+                  END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users BEGIN
+                      INSERT INTO users_fts (users_fts, rowid, {fields})
+                      VALUES ('delete', OLD.rowid, OLD.username, OLD.full_name, OLD.email, OLD.group_name);
+                  END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_users_fts_update
+                  AFTER UPDATE OF {fields} ON users BEGIN
+                      INSERT INTO users_fts (users_fts, rowid, {fields})
+                      VALUES ('delete', OLD.rowid, OLD.username, OLD.full_name, OLD.email, OLD.group_name);
+                      INSERT INTO users_fts (rowid, {fields})
+                      VALUES (NEW.rowid, NEW.username, NEW.full_name, NEW.email, NEW.group_name);
+                  END""")
+    c.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+    # Постраничный вывод студентов по имени (с фильтром по группе и без)
+    c.execute("DROP INDEX IF EXISTS idx_users_role_group")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_users_role_group_name
+                 ON users (role, group_name, COALESCE(full_name, ''), username)""")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_users_role_name
+                 ON users (role, COALESCE(full_name, ''), username)""")
+
+
+@migration(6, "сессии тестирования с серверным дедлайном")
+def _migrate_test_sessions(c: sqlite3.Cursor):
+    # Время хранится в секундах Unix: дедлайн сравнивается с time.time() без разбора дат
+    c.execute("""CREATE TABLE IF NOT EXISTS test_sessions (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        question_id INTEGER,
-        correct_answers JSON NOT NULL,
-        answer_hash TEXT NOT NULL,
-        FOREIGN KEY (question_id) REFERENCES test_questions (id) ON DELETE CASCADE
-    )''')
-
-    # Таблица результатов
-    c.execute('''CREATE TABLE IF NOT EXISTS test_results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        test_id INTEGER,
-        student_username TEXT,
-        answers JSON,
-        score INTEGER,
-        max_score INTEGER,
-        time_spent INTEGER,
-        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        attempt_number INTEGER,
+        test_id INTEGER NOT NULL,
+        student_username TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        deadline REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'active',
+        closed_at REAL,
         FOREIGN KEY (test_id) REFERENCES tests (id),
         FOREIGN KEY (student_username) REFERENCES users (username)
-    )''')
+    )""")
+    # Не больше одной открытой сессии студента на тест
+    c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_test_sessions_active
+                 ON test_sessions (test_id, student_username) WHERE status = 'active'""")
+    # Поиск просроченных сессий фоновой очисткой
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_sessions_deadline
+                 ON test_sessions (deadline) WHERE status = 'active'""")
+
+
+# Счетчик попыток студента по тесту (миграция 7)
+_STATS_STUDENT_TEST_V7: Dict[str, Any] = {
+    "source": "test_results r",
+    "keys": [
+        ("student_username", "r.student_username", "{row}.student_username"),
+        ("test_id", "r.test_id", "{row}.test_id"),
+    ],
+    "measures": [
+        ("attempts", "COUNT(*)", "sum"),
+        ("last_attempt", "MAX(r.attempt_number)", "max"),
+    ],
+}
+
+
+@migration(7, "уникальные номера попыток, токен отправки и счетчик попыток")
+def _migrate_attempt_allocation(c: sqlite3.Cursor):
+    # Старые гонки могли оставить повторяющиеся или пустые номера попыток:
+    # такие пары (тест, студент) перенумеровываем по времени прохождения
+    c.execute("""UPDATE test_results SET attempt_number = numbered.rn
+                 FROM (SELECT id, ROW_NUMBER() OVER (
+                           PARTITION BY test_id, student_username ORDER BY completed_at, id) AS rn
+                       FROM test_results) AS numbered
+                 WHERE numbered.id = test_results.id
+                   AND test_results.attempt_number IS NOT numbered.rn
+                   AND (test_results.test_id, test_results.student_username) IN (
+                       SELECT test_id, student_username FROM test_results
+                       GROUP BY test_id, student_username
+                       HAVING COUNT(*) <> COUNT(DISTINCT attempt_number))""")
+    c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_test_results_attempt
+                 ON test_results (test_id, student_username, attempt_number)""")
+
+    # Повторная отправка с тем же токеном возвращает уже сохраненный результат
+    c.execute("ALTER TABLE test_results ADD COLUMN submission_token TEXT")
+    c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_test_results_token
+                 ON test_results (submission_token) WHERE submission_token IS NOT NULL""")
+
+    # Счетчик заполняется уже после перенумерации попыток
+    spec = _STATS_STUDENT_TEST_V7
+    for statement in _summary_schema_sql("stats_student_test", spec):
+        c.execute(statement)
+    c.execute(f"INSERT INTO stats_student_test ({_summary_columns(spec)}) {_summary_select(spec, '1')}")
+
+
+@migration(8, "ответы по вопросам (test_result_items)")
+def _migrate_result_items(c: sqlite3.Cursor):
+    # Строка на каждый вопрос ключа ответов, включая оставленные без ответа
+    c.execute("""CREATE TABLE IF NOT EXISTS test_result_items (
+        result_id INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        is_correct INTEGER NOT NULL,
+        points_awarded INTEGER NOT NULL,
+        max_points INTEGER NOT NULL,
+        answer JSON,
+        time_spent INTEGER,
+        PRIMARY KEY (result_id, question_id),
+        FOREIGN KEY (result_id) REFERENCES test_results (id) ON DELETE CASCADE,
+        FOREIGN KEY (question_id) REFERENCES test_questions (id)
+    ) WITHOUT ROWID""")
+    # Статистика по вопросу читается только из индекса
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_result_items_question
+                 ON test_result_items (question_id, is_correct, points_awarded, time_spent)""")
+    # PRAGMA foreign_keys не включена, поэтому каскад делаем триггером
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_test_results_items_delete
+                 AFTER DELETE ON test_results BEGIN
+                     DELETE FROM test_result_items WHERE result_id = OLD.id;
+                 END""")
+
+    # Разбор накопленных JSON-ответов - один раз, по текущим ключам ответов.
+    # Проверка записана здесь же, чтобы миграция не зависела от будущих версий
+    # grade_answer_items; hash_answer - формат хранимых хешей ключа
+    answer_keys: Dict[int, List[tuple]] = {}
+    c.execute("""SELECT q.test_id, q.id, COALESCE(q.points, 0), a.answer_hash
+                 FROM test_questions q
+                 LEFT JOIN test_answers a ON a.question_id = q.id
+                 ORDER BY q.test_id, q.question_order""")
+    for test_id, question_id, points, answer_hash in c.fetchall():
+        answer_keys.setdefault(test_id, []).append((question_id, points, answer_hash))
+
+    c.execute("SELECT id, test_id, answers FROM test_results")
+    for result_id, test_id, answers in c.fetchall():
+        try:
+            answers = json.loads(answers) if answers else {}
+        except (TypeError, ValueError):
+            answers = {}
+        if not isinstance(answers, dict):
+            answers = {}
+        items = []
+        for question_id, points, answer_hash in answer_keys.get(test_id, []):
+            answer = answers.get(str(question_id))
+            correct = bool(answer) and answer_hash == hash_answer(answer)
+            items.append((result_id, question_id, int(correct), points if correct else 0, points,
+                          json.dumps(answer, ensure_ascii=False) if answer not in (None, "", []) else None))
+        c.executemany("""INSERT INTO test_result_items (result_id, question_id, is_correct, points_awarded,
+                                                        max_points, answer)
+                         VALUES (?, ?, ?, ?, ?, ?)""", items)
+
+
+# Все сводные таблицы после миграции 9 и условие, по которому их триггеры UPDATE
+# пропускают пересчет (флаг выставляется и снимается внутри одной транзакции записи)
+_SUMMARY_TABLES_V9: Dict[str, Dict[str, Any]] = {**_SUMMARY_TABLES_V2, "stats_student_test": _STATS_STUDENT_TEST_V7}
+_SUMMARY_UPDATE_GUARD_V9 = "(SELECT value FROM stats_meta WHERE name = 'summary_deferred') IS NOT 1"
+
+
+@migration(9, "отложенный пересчет сводных таблиц при массовых изменениях")
+def _migrate_deferred_summary_updates(c: sqlite3.Cursor):
+    c.execute("INSERT OR IGNORE INTO stats_meta (name, value) VALUES ('summary_deferred', 0)")
+    # Триггеры UPDATE пересоздаются с условием WHEN по флагу
+    for table, spec in _SUMMARY_TABLES_V9.items():
+        c.execute(f"DROP TRIGGER IF EXISTS trg_{table}_update")
+        for statement in _summary_schema_sql(table, spec, update_guard=_SUMMARY_UPDATE_GUARD_V9):
+            if f"trg_{table}_update" in statement:
+                c.execute(statement)
+
+
+@migration(10, "индекс по дате прохождения теста")
+def _migrate_completed_day_index(c: sqlite3.Cursor):
+    # Выражение совпадает с ключом day в stats_student_day: пересчет дня в триггерах
+    # и _refresh_summary_rows ищет по индексу, а не перебирает всю историю студента
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_test_results_student_day
+                 ON test_results (student_username, DATE(completed_at))""")
+
+
+# Сводки по группам читал только дашборд, который теперь считает их по выборке
+# результатов преподавателя (data/analytics.py); триггеры больше не нужны при каждой записи
+_DROPPED_SUMMARY_TABLES_V11 = ("stats_group", "stats_group_test")
+_SUMMARY_TABLES_V11: Dict[str, Dict[str, Any]] = {
+    table: spec for table, spec in _SUMMARY_TABLES_V9.items() if table not in _DROPPED_SUMMARY_TABLES_V11
+}
+
+
+@migration(11, "удаление сводных таблиц по группам")
+def _migrate_drop_group_summaries(c: sqlite3.Cursor):
+    for table in _DROPPED_SUMMARY_TABLES_V11:
+        for event in ("insert", "delete", "update", "user_group"):
+            c.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{event}")
+        c.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+@migration(12, "версия результатов теста в таблице tests")
+def _migrate_test_results_version(c: sqlite3.Cursor):
+    # Меняется при любом изменении результатов теста; перепроверка увеличивает ее сама,
+    # потому что может переписать ответы по вопросам, не меняя баллы попыток
+    c.execute("ALTER TABLE tests ADD COLUMN results_version INTEGER NOT NULL DEFAULT 0")
+    bump = "UPDATE tests SET results_version = results_version + 1 WHERE id IN ({ids});"
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_test_results_test_version_insert
+                  AFTER INSERT ON test_results BEGIN {bump.format(ids="NEW.test_id")} END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_test_results_test_version_delete
+                  AFTER DELETE ON test_results BEGIN {bump.format(ids="OLD.test_id")} END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_test_results_test_version_update
+                  AFTER UPDATE ON test_results BEGIN {bump.format(ids="OLD.test_id, NEW.test_id")} END""")
+
+
+# Сводку по тестам (средние, распределение оценок, время) больше никто не читает:
+# анализ заданий сверяется с tests.results_version, а триггер пересчитывал ее при каждой записи
+_SUMMARY_TABLES_V13: Dict[str, Dict[str, Any]] = {
+    table: spec for table, spec in _SUMMARY_TABLES_V11.items() if table != "stats_test"
+}
+
+
+@migration(13, "удаление сводной таблицы по тестам")
+def _migrate_drop_test_summary(c: sqlite3.Cursor):
+    for event in ("insert", "delete", "update"):
+        c.execute(f"DROP TRIGGER IF EXISTS trg_stats_test_{event}")
+    c.execute("DROP TABLE IF EXISTS stats_test")
 
-    conn.commit()
-    conn.close()
 
-    create_default_teacher()
+# =============================================================================
+# СВОДНЫЕ ТАБЛИЦЫ СТАТИСТИКИ
+# =============================================================================
 
+# Диапазоны оценок в процентах (нижняя граница включительно), по возрастанию
+GRADE_RANGES = [('0-59%', 0), ('60-69%', 60), ('70-79%', 70), ('80-89%', 80), ('90-100%', 90)]
+
+
+def _grade_bucket_columns(percent_sql: str, exists_sql: str = "1",
+                          lows: Optional[List[int]] = None) -> List[str]:
+    """SQL-выражения SUM(...) с количеством результатов в каждом диапазоне оценок.
+
+    exists_sql отсеивает пустые строки LEFT JOIN, чтобы они не попали в нижний диапазон.
+    lows - нижние границы диапазонов (по умолчанию из GRADE_RANGES).
+    """
+    columns = []
+    lows = lows if lows is not None else [low for _, low in GRADE_RANGES]
+    for low, high in zip(lows, lows[1:] + [None]):
+        if low == 0:
+            # Как и раньше, результат без max_score попадает в нижний диапазон
+            condition = f"{exists_sql} AND COALESCE({percent_sql}, 0) < {high}"
+        elif high is None:
+            condition = f"{percent_sql} >= {low}"
+        else:
+            condition = f"{percent_sql} >= {low} AND {percent_sql} < {high}"
+        columns.append(f"SUM(CASE WHEN {condition} THEN 1 ELSE 0 END)")
+    return columns
+
+
+# Текущая схема сводных таблиц - из последней миграции, которая их меняла (13).
+# Пересчеты во время работы (_refresh_summary_rows, rebuild_summary_tables) идут по ней;
+# диапазоны grade_ranges в спецификации совпадают с GRADE_RANGES
+SUMMARY_TABLES: Dict[str, Dict[str, Any]] = _SUMMARY_TABLES_V13
+
+
+def _summary_measures(spec: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """Показатели сводной таблицы с подставленными столбцами распределения оценок"""
+    buckets = _grade_bucket_columns(spec["percent"], lows=spec["grade_ranges"]) if "grade_ranges" in spec else []
+    measures = []
+    for name, aggregate, merge in spec["measures"]:
+        if aggregate is None:
+            aggregate = buckets[int(name.rsplit("_", 1)[1])]
+        measures.append((name, aggregate, merge))
+    return measures
+
+
+def _summary_select(spec: Dict[str, Any], where: str) -> str:
+    """SELECT, агрегирующий test_results в строки сводной таблицы"""
+    keys = ", ".join(expr for _, expr, _ in spec["keys"])
+    aggregates = ", ".join(aggregate for _, aggregate, _ in _summary_measures(spec))
+    return f"SELECT {keys}, {aggregates} FROM {spec['source']} WHERE {where} GROUP BY {keys}"
+
+
+def _summary_columns(spec: Dict[str, Any]) -> str:
+    return ", ".join([name for name, _, _ in spec["keys"]] + [name for name, _, _ in spec["measures"]])
+
+
+def _summary_recompute_sql(table: str, key_values: Dict[str, str],
+                           spec: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Пересчет строк сводной таблицы для заданных значений ключа (после DELETE/UPDATE)"""
+    spec = spec or SUMMARY_TABLES[table]
+    expressions = {name: expr for name, expr, _ in spec["keys"]}
+    delete_where = " AND ".join(f"{name} IS {value}" for name, value in key_values.items())
+    source_where = " AND ".join(f"{expressions[name]} IS {value}" for name, value in key_values.items())
+    return [
+        f"DELETE FROM {table} WHERE {delete_where}",
+        f"INSERT INTO {table} ({_summary_columns(spec)}) {_summary_select(spec, source_where)}",
+    ]
+
+
+def _summary_column_type(name: str) -> str:
+    if name == "last_completed_at":
+        return "TEXT"
+    if "percent" in name and not name.endswith("_count"):
+        return "REAL"
+    return "INTEGER"
 
-def create_default_teacher():
-    """Создает преподавателя по умолчанию"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-
-    c.execute("SELECT username FROM users WHERE username = ?", ("teacher",))
-    if not c.fetchone():
-        hashed_password = bcrypt.hashpw("10209065".encode('utf-8'), bcrypt.gensalt())
-        
-        c.execute("""INSERT INTO users (username, password, role, full_name, group_name, email) 
-                     VALUES (?, ?, ?, ?, ?, ?)""",
-                  ("teacher", hashed_password, "Преподаватель", "Преподаватель", "ИТ-преподаватели", "teacher@college.ru"))
-        conn.commit()
-        print("✅ Преподаватель teacher создан")
-    
-    conn.close()
+
+def _summary_schema_sql(table: str, spec: Dict[str, Any], update_guard: Optional[str] = None) -> List[str]:
+    """DDL сводной таблицы по спецификации миграции и триггеры, поддерживающие ее в актуальном состоянии.
+
+    update_guard - условие WHEN, при котором триггер UPDATE выполняет пересчет.
+    """
+    key_names = [name for name, _, _ in spec["keys"]]
+    columns = [f"{name} {'TEXT' if name in ('student_username', 'group_name', 'day') else 'INTEGER'} NOT NULL"
+               for name in key_names]
+    columns += [f"{name} {_summary_column_type(name)}" for name, _, _ in spec["measures"]]
+    columns += spec.get("extra_columns", [])
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(columns)}, PRIMARY KEY ({', '.join(key_names)}))"
+    ]
+    for i, index in enumerate(spec.get("indexes", []), 1):
+        statements.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_{i} ON {table} {index}")
+
+    # Вставка: строка уже в test_results, поэтому агрегируем ее по r.id и сливаем с накопленным
+    merge = {
+        "sum": "COALESCE({t}.{c}, 0) + COALESCE(excluded.{c}, 0)",
+        "max": "MAX(COALESCE({t}.{c}, excluded.{c}), COALESCE(excluded.{c}, {t}.{c}))",
+        "min": "MIN(COALESCE({t}.{c}, excluded.{c}), COALESCE(excluded.{c}, {t}.{c}))",
+    }
+    updates = ", ".join(f"{name} = " + merge[kind].format(t=table, c=name) for name, _, kind in spec["measures"])
+    statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON test_results BEGIN
+        INSERT INTO {table} ({_summary_columns(spec)}) {_summary_select(spec, "r.id = NEW.id")}
+        ON CONFLICT ({', '.join(key_names)}) DO UPDATE SET {updates};
+    END""")
+
+    # Удаление и изменение - пересчет затронутых ключей по индексам
+    old_keys = {name: template.format(row="OLD") for name, _, template in spec["keys"]}
+    new_keys = {name: template.format(row="NEW") for name, _, template in spec["keys"]}
+    delete_body = ";\n        ".join(_summary_recompute_sql(table, old_keys, spec))
+    update_body = ";\n        ".join(_summary_recompute_sql(table, old_keys, spec)
+                                   + _summary_recompute_sql(table, new_keys, spec))
+    statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON test_results BEGIN
+        {delete_body};
+    END""")
+    statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_update
+        AFTER UPDATE OF test_id, student_username, score, max_score, time_spent, completed_at ON test_results
+        {f"WHEN {update_guard} " if update_guard else ""}BEGIN
+        {update_body};
+    END""")
+
+    # Смена группы или роли студента переносит его результаты между группами
+    if "group_name" in key_names:
+        group_body = ";\n        ".join(_summary_recompute_sql(table, {"group_name": "OLD.group_name"}, spec)
+                                      + _summary_recompute_sql(table, {"group_name": "NEW.group_name"}, spec))
+        statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_user_group
+        AFTER UPDATE OF group_name, role ON users BEGIN
+        {group_body};
+    END""")
+    return statements
+
+
+def _refresh_summary_rows(c: sqlite3.Cursor, result_ids: List[int]):
+    """Пересчет строк сводных таблиц, затронутых изменением результатов (ключи не менялись)"""
+    placeholders = ','.join('?' for _ in result_ids)
+    for table, spec in SUMMARY_TABLES.items():
+        keys = ", ".join(expr for _, expr, _ in spec["keys"])
+        c.execute(f"SELECT DISTINCT {keys} FROM {spec['source']} WHERE r.id IN ({placeholders})", result_ids)
+        affected = c.fetchall()
+        for statement in _summary_recompute_sql(table, {name: "?" for name, _, _ in spec["keys"]}):
+            c.executemany(statement, affected)
+
+
+def rebuild_summary_tables():
+    """Полный пересчет сводных таблиц статистики из test_results"""
+    with DatabaseManager.transaction(immediate=True) as conn:
+        for table, spec in SUMMARY_TABLES.items():
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} ({_summary_columns(spec)}) {_summary_select(spec, '1')}")
+
+
+# =============================================================================
+# КЕШ ЧТЕНИЯ
+# =============================================================================
+
+class ReadCache:
+    """LRU-кеш с TTL, общий для всех сессий Streamlit в процессе"""
+
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, namespace: str, counter: str):
+        counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0, "invalidations": 0})
+        counters[counter] += 1
+
+    def get(self, key: Tuple) -> Tuple[bool, Any]:
+        """Возвращает (найдено, значение)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self._count(key[0], "hits")
+                return True, entry[1]
+            if entry is not None:
+                del self._data[key]
+            self._count(key[0], "misses")
+            return False, None
+
+    def set(self, key: Tuple, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, namespace: str, *args):
+        """Удаляет одну запись: invalidate("test_questions", test_id)"""
+        with self._lock:
+            if self._data.pop((namespace,) + args, None) is not None:
+                self._count(namespace, "invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов по пространствам имен"""
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._counters.items()}
+            hits = sum(counters["hits"] for counters in namespaces.values())
+            misses = sum(counters["misses"] for counters in namespaces.values())
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses) * 100, 1) if hits + misses else 0.0,
+                "namespaces": namespaces
+            }
+
+
+read_cache = ReadCache()
+
+
+def cached(namespace: str):
+    """Кеширует результат функции чтения по ее аргументам.
+
+    Вызывающий получает копию, поэтому изменения результата не портят кеш.
+    Исходная функция доступна как func.uncached.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (namespace,) + tuple(bound.arguments.values())
+            found, value = read_cache.get(key)
+            if not found:
+                value = func(*args, **kwargs)
+                read_cache.set(key, value)
+            return copy.deepcopy(value)
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Статистика кеша чтения (попадания, промахи, размер)"""
+    return read_cache.stats()
 
 
 # =============================================================================
 # ФУНКЦИИ ДЛЯ РАБОТЫ С ПОЛЬЗОВАТЕЛЯМИ
 # =============================================================================
 
+# bcrypt отпускает GIL, поэтому проверка паролей в отдельных потоках
+# не занимает поток скрипта Streamlit, а размер пула ограничивает нагрузку на CPU
+_auth_pool = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="dblearn-auth")
+
+
+def _hash_password(password: str, rounds: Optional[int] = None) -> bytes:
+    """Хеширование одного пароля (функция верхнего уровня для пулов)"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds or BCRYPT_ROUNDS))
+
+
+def _hash_rounds(password_hash: bytes) -> int:
+    """Стоимость bcrypt, с которой был получен хеш ($2b$12$...)"""
+    try:
+        return int(password_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _verify_password(password: str, password_hash: bytes) -> Optional[bytes]:
+    """Проверка пароля; при устаревшей стоимости возвращает новый хеш"""
+    if not bcrypt.checkpw(password.encode('utf-8'), password_hash):
+        return None
+    if _hash_rounds(password_hash) != BCRYPT_ROUNDS:
+        return _hash_password(password)
+    return password_hash
+
+
+def _invalidate_user(username: str):
+    """Сбрасывает кешированные данные пользователя (в том числе закешированное отсутствие)"""
+    read_cache.invalidate("user_role", username)
+    read_cache.invalidate("student_data", username)
+
+
 def add_user(username: str, password: str, role: str, full_name: Optional[str] = None, 
              group_name: Optional[str] = None, email: Optional[str] = None) -> bool:
     """Добавление нового пользователя"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-
-    # Проверка существующего пользователя
-    c.execute("SELECT username FROM users WHERE username = ?", (username,))
-    if c.fetchone():
-        conn.close()
-        return False
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    c.execute("""INSERT INTO users (username, password, role, full_name, group_name, email) 
-                 VALUES (?, ?, ?, ?, ?, ?)""",
-              (username, hashed_password, role, full_name, group_name, email))
-    
-    conn.commit()
-    conn.close()
+        # Проверка существующего пользователя
+        c.execute("SELECT username FROM users WHERE username = ?", (username,))
+        if c.fetchone():
+            return False
+
+        hashed_password = _auth_pool.submit(_hash_password, password).result(timeout=AUTH_TIMEOUT)
+        try:
+            with DatabaseManager.transaction():
+                c.execute("""INSERT INTO users (username, password, role, full_name, group_name, email) 
+                             VALUES (?, ?, ?, ?, ?, ?)""",
+                          (username, hashed_password, role, full_name, group_name, email))
+        except sqlite3.IntegrityError:
+            # Логин успели занять параллельно, пока считался хеш
+            return False
+
+    _invalidate_user(username)
     return True
 
 
+def login_user(username: str, password: str) -> Optional[Dict[str, Any]]:
+    """Аутентификация: данные пользователя и роль одним запросом или None"""
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT username, password, role, full_name, group_name 
+                     FROM users WHERE username = ?""", (username,))
+        result = c.fetchone()
+
+    if not result:
+        return None
+
+    stored_hash = result[1].encode('utf-8') if isinstance(result[1], str) else result[1]
+    current_hash = _auth_pool.submit(_verify_password, password, stored_hash).result(timeout=AUTH_TIMEOUT)
+    if current_hash is None:
+        return None
+
+    # Прозрачное перехеширование после смены политики стоимости
+    if current_hash != stored_hash:
+        with DatabaseManager.transaction() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE username = ? AND password = ?",
+                         (current_hash, username, result[1]))
+
+    return {
+        "username": result[0],
+        "role": result[2],
+        "full_name": result[3],
+        "group": result[4]
+    }
+
+
 def authenticate_user(username: str, password: str) -> bool:
     """Аутентификация пользователя"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT password FROM users WHERE username = ?", (username,))
-    result = c.fetchone()
-    conn.close()
-    
-    if result and bcrypt.checkpw(password.encode('utf-8'), result[0]):
-        return True
-    return False
+    return login_user(username, password) is not None
 
 
+@cached("user_role")
 def get_user_role(username: str) -> Optional[str]:
     """Получение роли пользователя"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT role FROM users WHERE username = ?", (username,))
-    result = c.fetchone()
-    conn.close()
-    
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT role FROM users WHERE username = ?", (username,))
+        result = c.fetchone()
+
     return result[0] if result else None
 
 
+@routed
 def get_all_students() -> List[Dict[str, Any]]:
     """Получение списка всех студентов"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT username, full_name, group_name, email FROM users WHERE role = 'Студент'")
-    students = [
-        {
-            "username": row[0],
-            "full_name": row[1],
-            "group": row[2],
-            "email": row[3]
-        } for row in c.fetchall()
-    ]
-    
-    conn.close()
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT username, full_name, group_name, email FROM users WHERE role = 'Студент'")
+        students = [
+            {
+                "username": row[0],
+                "full_name": row[1],
+                "group": row[2],
+                "email": row[3]
+            } for row in c.fetchall()
+        ]
+
     return students
 
 
+@cached("student_data")
 def get_student_data(username: str) -> Optional[Dict[str, Any]]:
     """Получение данных студента"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT username, full_name, group_name, email, created_at FROM users WHERE username = ?", (username,))
-    result = c.fetchone()
-    conn.close()
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT username, full_name, group_name, email, created_at FROM users WHERE username = ?", (username,))
+        result = c.fetchone()
 
     if result:
         return {
@@ -199,6 +1195,192 @@ def get_student_data(username: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+def _fts_query(text: str) -> str:
+    """Поисковая строка пользователя -> запрос FTS5: все слова как префиксы"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _student_search_filter(query: Optional[str], group: Optional[str]) -> Tuple[str, str, List[Any]]:
+    """FROM и WHERE для поиска студентов (общие для выборки страницы и подсчета)"""
+    params: List[Any] = []
+    source = "users u"
+    conditions = ["u.role = 'Студент'"]
+    if query and query.strip():
+        source = "users_fts f JOIN users u ON u.rowid = f.rowid"
+        conditions.append("users_fts MATCH ?")
+        params.append(_fts_query(query))
+    if group:
+        conditions.append("u.group_name = ?")
+        params.append(group)
+    return source, " AND ".join(conditions), params
+
+
+@routed
+def search_students(query: Optional[str] = None, group: Optional[str] = None, limit: int = 20,
+                    cursor: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+    """Страница студентов по поисковому запросу (имя, логин, email, группа).
+
+    Сортировка по имени; cursor - пара (имя, логин) последней строки предыдущей
+    страницы. Возвращает {'rows': [...], 'next_cursor': ...}.
+    """
+    source, where, params = _student_search_filter(query, group)
+    if cursor is not None:
+        where += " AND (COALESCE(u.full_name, ''), u.username) > (?, ?)"
+        params.extend(cursor)
+
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT u.username, u.full_name, u.group_name, u.email
+                      FROM {source}
+                      WHERE {where}
+                      ORDER BY COALESCE(u.full_name, ''), u.username
+                      LIMIT ?""", params + [limit + 1])
+        rows = c.fetchall()
+
+    students = [
+        {
+            "username": row[0],
+            "full_name": row[1],
+            "group": row[2],
+            "email": row[3]
+        } for row in rows[:limit]
+    ]
+    next_cursor = (students[-1]["full_name"] or "", students[-1]["username"]) if len(rows) > limit else None
+    return {"rows": students, "next_cursor": next_cursor}
+
+
+@routed
+def count_students(query: Optional[str] = None, group: Optional[str] = None) -> int:
+    """Количество студентов, подходящих под поиск (без загрузки строк)"""
+    source, where, params = _student_search_filter(query, group)
+    with DatabaseManager.connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {source} WHERE {where}", params).fetchone()[0]
+
+
+@routed
+def get_student_groups() -> List[str]:
+    """Список групп студентов"""
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT DISTINCT group_name FROM users
+                     WHERE role = 'Студент' AND group_name IS NOT NULL AND group_name <> ''
+                     ORDER BY group_name""")
+        return [row[0] for row in c.fetchall()]
+
+
+def rebuild_search_index():
+    """Перестроение полнотекстового индекса пользователей (например, после VACUUM)"""
+    with DatabaseManager.transaction() as conn:
+        conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+# =============================================================================
+# МАССОВЫЙ ИМПОРТ СТУДЕНТОВ
+# =============================================================================
+
+def hash_passwords(passwords: List[str], workers: Optional[int] = None) -> List[bytes]:
+    """Хеширование паролей bcrypt на всех ядрах через пул процессов"""
+    if len(passwords) < 4 or workers == 1:
+        return [_hash_password(password) for password in passwords]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(passwords) // ((workers or os.cpu_count() or 1) * 4))
+        # Стоимость передается явно: дочерние процессы не видят настроек родителя
+        return list(pool.map(partial(_hash_password, rounds=BCRYPT_ROUNDS), passwords, chunksize=chunksize))
+
+
+def load_roster(path: str) -> List[Dict[str, Any]]:
+    """Чтение списка студентов из CSV или JSON файла"""
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    roster = []
+    for row in rows:
+        roster.append({
+            "username": (row.get("username") or "").strip(),
+            "password": row.get("password") or "",
+            "full_name": row.get("full_name") or None,
+            "group": row.get("group") or row.get("group_name") or None,
+            "email": row.get("email") or None
+        })
+    return roster
+
+
+def import_students(roster: List[Dict[str, Any]], role: str = "Студент",
+                    workers: Optional[int] = None) -> Dict[str, Any]:
+    """Массовое добавление пользователей.
+
+    Возвращает {'added': [логины], 'conflicts': [{'row', 'username', 'reason'}]},
+    где row - номер строки в списке (с 1).
+    """
+    conflicts = []
+    candidates = {}
+    for row_number, student in enumerate(roster, 1):
+        username = student.get("username")
+        if not username or not student.get("password"):
+            conflicts.append({"row": row_number, "username": username, "reason": "нет логина или пароля"})
+        elif username in candidates:
+            conflicts.append({"row": row_number, "username": username, "reason": "повтор в списке"})
+        else:
+            candidates[username] = (row_number, student)
+
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+
+        # Один запрос на проверку уже занятых логинов (до хеширования паролей)
+        existing = set()
+        usernames = list(candidates)
+        for start in range(0, len(usernames), SQL_IN_CHUNK):
+            chunk = usernames[start:start + SQL_IN_CHUNK]
+            placeholders = ','.join('?' for _ in chunk)
+            c.execute(f"SELECT username FROM users WHERE username IN ({placeholders})", chunk)
+            existing.update(row[0] for row in c.fetchall())
+
+        for username in existing:
+            conflicts.append({"row": candidates.pop(username)[0], "username": username,
+                              "reason": "пользователь уже существует"})
+
+        new_students = [student for _, student in candidates.values()]
+        hashed = hash_passwords([student["password"] for student in new_students], workers)
+
+        rows = [
+            (student["username"], password_hash, role, student.get("full_name"),
+             student.get("group"), student.get("email"))
+            for student, password_hash in zip(new_students, hashed)
+        ]
+        with DatabaseManager.transaction():
+            c.executemany("""INSERT OR IGNORE INTO users (username, password, role, full_name, group_name, email) 
+                             VALUES (?, ?, ?, ?, ?, ?)""", rows)
+            inserted = c.rowcount
+
+            # Логин мог быть занят параллельно после проверки - такие строки пропущены
+            if inserted != len(rows):
+                ours = {row[0]: row[1] for row in rows}
+                for start in range(0, len(rows), SQL_IN_CHUNK):
+                    chunk = [row[0] for row in rows[start:start + SQL_IN_CHUNK]]
+                    placeholders = ','.join('?' for _ in chunk)
+                    c.execute(f"SELECT username, password FROM users WHERE username IN ({placeholders})", chunk)
+                    for username, password_hash in c.fetchall():
+                        if password_hash != ours[username]:
+                            ours.pop(username)
+                            conflicts.append({"row": candidates[username][0], "username": username,
+                                              "reason": "пользователь уже существует"})
+                added = list(ours)
+            else:
+                added = [row[0] for row in rows]
+
+    for username in added:
+        _invalidate_user(username)
+
+    conflicts.sort(key=lambda item: item["row"])
+    return {"added": added, "conflicts": conflicts}
+
+
 # =============================================================================
 # ФУНКЦИИ ДЛЯ СИСТЕМЫ ТЕСТИРОВАНИЯ
 # =============================================================================
@@ -214,20 +1396,26 @@ def hash_answer(answer: Any) -> str:
     return hashlib.sha256(f"{answer_str}{salt}".encode()).hexdigest()
 
 
+def _invalidate_test(test_id: int, created_by: Optional[str] = None):
+    """Сбрасывает кешированные данные теста после изменения"""
+    read_cache.invalidate("test", test_id)
+    read_cache.invalidate("test_questions", test_id)
+    read_cache.invalidate("answer_key", test_id)
+    if created_by is not None:
+        read_cache.invalidate("teacher_tests", created_by)
+
+
 def create_test(title: str, description: str, time_limit: int = 60, 
                 max_attempts: int = 1, created_by: str = "teacher") -> int:
     """Создание нового теста"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("""INSERT INTO tests (title, description, time_limit, max_attempts, created_by) 
-                 VALUES (?, ?, ?, ?, ?)""",
-              (title, description, time_limit, max_attempts, created_by))
-    
-    test_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    
+    with DatabaseManager.transaction() as conn:
+        c = conn.cursor()
+        c.execute("""INSERT INTO tests (title, description, time_limit, max_attempts, created_by) 
+                     VALUES (?, ?, ?, ?, ?)""",
+                  (title, description, time_limit, max_attempts, created_by))
+        test_id = c.lastrowid
+
+    _invalidate_test(test_id, created_by)
     return test_id
 
 
@@ -235,36 +1423,73 @@ def create_secure_question(test_id: int, question_text: str, options: List[str],
                           correct_answers: List[str], question_type: str = "single_choice", 
                           points: int = 1, question_order: int = 0) -> int:
     """Создание вопроса с хешированными ответами"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
+    with DatabaseManager.transaction() as conn:
+        c = conn.cursor()
 
-    # Сохраняем вопрос
-    c.execute("""INSERT INTO test_questions (test_id, question_text, question_type, options, points, question_order) 
-                 VALUES (?, ?, ?, ?, ?, ?)""",
-              (test_id, question_text, question_type, json.dumps(options), points, question_order))
+        # Сохраняем вопрос
+        c.execute("""INSERT INTO test_questions (test_id, question_text, question_type, options, points, question_order) 
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+                  (test_id, question_text, question_type, json.dumps(options), points, question_order))
+
+        question_id = c.lastrowid
 
-    question_id = c.lastrowid
+        # Сохраняем хеши правильных ответов
+        answers_hash = hash_answer(correct_answers)
+        c.execute("""INSERT INTO test_answers (question_id, correct_answers, answer_hash) 
+                     VALUES (?, ?, ?)""",
+                  (question_id, json.dumps(correct_answers), answers_hash))
 
-    # Сохраняем хеши правильных ответов
-    answers_hash = hash_answer(correct_answers)
-    c.execute("""INSERT INTO test_answers (question_id, correct_answers, answer_hash) 
-                 VALUES (?, ?, ?)""",
-              (question_id, json.dumps(correct_answers), answers_hash))
+        # Триггер обновил счетчики вопросов теста - сбрасываем и список тестов автора
+        c.execute("SELECT created_by FROM tests WHERE id = ?", (test_id,))
+        row = c.fetchone()
 
-    conn.commit()
-    conn.close()
-    
+    _invalidate_test(test_id, row[0] if row else None)
     return question_id
 
 
+def create_test_with_questions(title: str, description: str, questions: List[Dict[str, Any]],
+                              time_limit: int = 60, max_attempts: int = 1, created_by: str = "teacher",
+                              shuffle_questions: bool = True, show_results: bool = False,
+                              is_active: bool = True) -> int:
+    """Создание теста вместе со всеми вопросами и хешами ответов в одной транзакции.
+
+    Каждый вопрос - словарь с ключами question_text, options, correct_answers и
+    необязательными question_type, points, question_order (по умолчанию - позиция в списке).
+    """
+    with DatabaseManager.transaction() as conn:
+        c = conn.cursor()
+        c.execute("""INSERT INTO tests (title, description, time_limit, max_attempts, created_by,
+                                        shuffle_questions, show_results, is_active) 
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                  (title, description, time_limit, max_attempts, created_by,
+                   shuffle_questions, show_results, is_active))
+        test_id = c.lastrowid
+
+        c.executemany("""INSERT INTO test_questions (test_id, question_text, question_type, options, points, question_order) 
+                         VALUES (?, ?, ?, ?, ?, ?)""",
+                      [(test_id, q['question_text'], q.get('question_type', 'single_choice'),
+                        json.dumps(q.get('options', [])), q.get('points', 1), q.get('question_order', i))
+                       for i, q in enumerate(questions)])
+
+        # Тест только что создан, поэтому id вопросов идут в порядке вставки
+        c.execute("SELECT id FROM test_questions WHERE test_id = ? ORDER BY id", (test_id,))
+        question_ids = [row[0] for row in c.fetchall()]
+
+        c.executemany("""INSERT INTO test_answers (question_id, correct_answers, answer_hash) 
+                         VALUES (?, ?, ?)""",
+                      [(question_id, json.dumps(q['correct_answers']), hash_answer(q['correct_answers']))
+                       for question_id, q in zip(question_ids, questions)])
+
+    _invalidate_test(test_id, created_by)
+    return test_id
+
+
 def verify_answer(question_id: int, student_answer: Any) -> bool:
     """Проверка ответа студента"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-
-    c.execute("SELECT answer_hash FROM test_answers WHERE question_id = ?", (question_id,))
-    result = c.fetchone()
-    conn.close()
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT answer_hash FROM test_answers WHERE question_id = ?", (question_id,))
+        result = c.fetchone()
 
     if not result:
         return False
@@ -272,167 +1497,286 @@ def verify_answer(question_id: int, student_answer: Any) -> bool:
     return result[0] == hash_answer(student_answer)
 
 
+@cached("teacher_tests")
 def get_teacher_tests(username: str) -> List[Dict[str, Any]]:
     """Получение тестов преподавателя"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT * FROM tests WHERE created_by = ? ORDER BY created_at DESC", (username,))
-    
-    tests = []
-    for row in c.fetchall():
-        tests.append({
-            'id': row[0],
-            'title': row[1],
-            'description': row[2],
-            'time_limit': row[3],
-            'max_attempts': row[4],
-            'shuffle_questions': bool(row[5]),
-            'show_results': bool(row[6]),
-            'created_by': row[7],
-            'created_at': row[8],
-            'is_active': bool(row[9])
-        })
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT id, title, description, time_limit, max_attempts, shuffle_questions,
+                            show_results, created_by, created_at, is_active, question_count, total_points
+                     FROM tests WHERE created_by = ? ORDER BY created_at DESC""", (username,))
+
+        tests = []
+        for row in c.fetchall():
+            tests.append({
+                'id': row[0],
+                'title': row[1],
+                'description': row[2],
+                'time_limit': row[3],
+                'max_attempts': row[4],
+                'shuffle_questions': bool(row[5]),
+                'show_results': bool(row[6]),
+                'created_by': row[7],
+                'created_at': row[8],
+                'is_active': bool(row[9]),
+                'question_count': row[10],
+                'total_points': row[11]
+            })
 
-    conn.close()
     return tests
 
 
+@cached("test_questions")
 def get_test_questions(test_id: int) -> List[Dict[str, Any]]:
     """Получение вопросов теста"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT * FROM test_questions WHERE test_id = ? ORDER BY question_order", (test_id,))
-    
-    questions = []
-    for row in c.fetchall():
-        questions.append({
-            'id': row[0],
-            'test_id': row[1],
-            'question_text': row[2],
-            'question_type': row[3],
-            'options': json.loads(row[4]) if row[4] else [],
-            'points': row[5],
-            'question_order': row[6]
-        })
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM test_questions WHERE test_id = ? ORDER BY question_order", (test_id,))
+
+        questions = []
+        for row in c.fetchall():
+            questions.append({
+                'id': row[0],
+                'test_id': row[1],
+                'question_text': row[2],
+                'question_type': row[3],
+                'options': json.loads(row[4]) if row[4] else [],
+                'points': row[5],
+                'question_order': row[6]
+            })
 
-    conn.close()
     return questions
 
 
 def get_available_tests(student_username: str) -> List[Dict[str, Any]]:
     """Получение доступных тестов для студента"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-
-    c.execute("""SELECT t.*, 
-                COALESCE(MAX(r.attempt_number), 0) as current_attempt,
-                COUNT(r.id) as completed_count
-                FROM tests t
-                LEFT JOIN test_results r ON t.id = r.test_id AND r.student_username = ?
-                WHERE t.is_active = TRUE
-                GROUP BY t.id
-                HAVING completed_count < t.max_attempts OR t.max_attempts = 0
-                """, (student_username,))
-
-    tests = []
-    for row in c.fetchall():
-        tests.append({
-            'id': row[0],
-            'title': row[1],
-            'description': row[2],
-            'time_limit': row[3],
-            'max_attempts': row[4],
-            'shuffle_questions': bool(row[5]),
-            'show_results': bool(row[6]),
-            'current_attempt': row[10] + 1,
-            'completed_count': row[11]
-        })
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT t.id, t.title, t.description, t.time_limit, t.max_attempts,
+                    t.shuffle_questions, t.show_results, t.question_count, t.total_points,
+                    COALESCE(a.last_attempt, 0) as current_attempt,
+                    COALESCE(a.attempts, 0) as completed_count
+                    FROM tests t
+                    LEFT JOIN stats_student_test a ON a.test_id = t.id AND a.student_username = ?
+                    WHERE t.is_active = TRUE
+                      AND (COALESCE(a.attempts, 0) < t.max_attempts OR t.max_attempts = 0)
+                    """, (student_username,))
+
+        tests = []
+        for row in c.fetchall():
+            tests.append({
+                'id': row[0],
+                'title': row[1],
+                'description': row[2],
+                'time_limit': row[3],
+                'max_attempts': row[4],
+                'shuffle_questions': bool(row[5]),
+                'show_results': bool(row[6]),
+                'question_count': row[7],
+                'total_points': row[8],
+                'current_attempt': row[9] + 1,
+                'completed_count': row[10]
+            })
 
-    conn.close()
     return tests
 
 
+@cached("answer_key")
+def get_answer_key(test_id: int) -> Dict[int, Dict[str, Any]]:
+    """Ключ ответов теста одним запросом: {question_id: {points, answer_hash}}"""
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT q.id, q.points, a.answer_hash
+                     FROM test_questions q
+                     LEFT JOIN test_answers a ON a.question_id = q.id
+                     WHERE q.test_id = ?
+                     ORDER BY q.question_order""", (test_id,))
+
+        return {
+            row[0]: {'points': row[1], 'answer_hash': row[2]}
+            for row in c.fetchall()
+        }
+
+
+def grade_answer_items(answer_key: Dict[int, Dict[str, Any]], answers: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Проверка ответов по ключу с результатом по каждому вопросу"""
+    items = []
+    for question_id, item in answer_key.items():
+        student_answer = answers.get(str(question_id))
+        correct = bool(student_answer) and item['answer_hash'] == hash_answer(student_answer)
+        items.append({
+            'question_id': question_id,
+            'is_correct': correct,
+            'points_awarded': item['points'] if correct else 0,
+            'max_points': item['points'],
+            'answer': student_answer if student_answer not in (None, "", []) else None
+        })
+    return items
+
+
+def grade_answers(answer_key: Dict[int, Dict[str, Any]], answers: Dict[str, Any]) -> tuple[int, int]:
+    """Проверка всех ответов в памяти по ключу ответов"""
+    items = grade_answer_items(answer_key, answers)
+    return sum(item['points_awarded'] for item in items), sum(item['max_points'] for item in items)
+
+
+def _insert_result_items(c: sqlite3.Cursor, result_id: int, items: List[Dict[str, Any]]):
+    """Записывает проверку по вопросам для одного результата"""
+    c.executemany("""INSERT INTO test_result_items (result_id, question_id, is_correct, points_awarded,
+                                                    max_points, answer, time_spent)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                  [(result_id, item['question_id'], int(item['is_correct']), item['points_awarded'],
+                    item['max_points'],
+                    json.dumps(item['answer'], ensure_ascii=False) if item['answer'] is not None else None,
+                    item.get('time_spent'))
+                   for item in items])
+
+
+class SubmissionRejected(ValueError):
+    """Отправка не засчитана (попытки исчерпаны, сессия закрыта); текст пригоден для показа студенту"""
+
+
 def submit_test_answers(test_id: int, student_username: str, 
-                       answers: Dict[str, Any], time_spent: int) -> tuple[int, int]:
-    """Отправка ответов на тест"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-
-    questions = get_test_questions(test_id)
-    max_score = sum(q['points'] for q in questions)
-    score = 0
-
-    # Проверяем ответы и считаем баллы
-    for question in questions:
-        student_answer = answers.get(str(question['id']))
-        if student_answer and verify_answer(question['id'], student_answer):
-            score += question['points']
-
-    # Определяем номер попытки
-    c.execute("""SELECT COALESCE(MAX(attempt_number), 0) 
-                 FROM test_results 
-                 WHERE test_id = ? AND student_username = ?""",
-              (test_id, student_username))
-    attempt_number = c.fetchone()[0] + 1
-
-    # Сохраняем результат
-    c.execute("""INSERT INTO test_results (test_id, student_username, answers, score, max_score, time_spent, attempt_number)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)""",
-              (test_id, student_username, json.dumps(answers), score, max_score, time_spent, attempt_number))
-
-    conn.commit()
-    conn.close()
-    
+                       answers: Dict[str, Any], time_spent: int,
+                       session_id: Optional[int] = None,
+                       submission_token: Optional[str] = None) -> tuple[int, int]:
+    """Отправка ответов на тест; SubmissionRejected, если отправка не засчитана"""
+    future = submit_test_answers_async(test_id, student_username, answers, time_spent,
+                                       session_id, submission_token)
+    return future.result(timeout=SUBMIT_TIMEOUT)
+
+
+def submit_test_answers_async(test_id: int, student_username: str,
+                              answers: Dict[str, Any], time_spent: int,
+                              session_id: Optional[int] = None,
+                              submission_token: Optional[str] = None) -> Future:
+    """Ставит ответы в очередь записи; Future вернет (score, max_score) после коммита
+    или исключение SubmissionRejected"""
+    # Проверяем ответы и считаем баллы в потоке вызывающего, писатель только пишет
+    items = grade_answer_items(get_answer_key(test_id), answers)
+    score = sum(item['points_awarded'] for item in items)
+    max_score = sum(item['max_points'] for item in items)
+    # Кешируемые данные (тест, вопросы, ключ ответов, пользователь) результат не меняет
+    return submission_writer.submit(test_id, student_username, answers, score, max_score,
+                                    time_spent, session_id, submission_token, items)
+
+
+def _record_submission(c: sqlite3.Cursor, test_id: int, student_username: str,
+                       answers: Dict[str, Any], score: int, max_score: int,
+                       time_spent: int, session_id: Optional[int],
+                       submission_token: Optional[str] = None,
+                       items: Optional[List[Dict[str, Any]]] = None,
+                       now: Optional[float] = None) -> tuple[int, int]:
+    """Сохраняет одну отправку и ее проверку по вопросам в уже открытой транзакции записи.
+
+    Единственный путь выдачи номера попытки: отправки студентов и закрытие просроченных сессий.
+    Незасчитанная отправка вызывает SubmissionRejected; сделанные до этого изменения
+    (закрытие сессии) вызывающий сохраняет.
+    """
+    if submission_token:
+        # Повтор (двойной клик, перезапуск скрипта) - возвращаем уже записанный результат
+        c.execute("SELECT score, max_score FROM test_results WHERE submission_token = ?",
+                  (submission_token,))
+        existing = c.fetchone()
+        if existing:
+            return existing[0], existing[1]
+
+    # Номер попытки выдается под блокировкой записи по счетчику, а не по MAX() результатов
+    c.execute("""SELECT a.attempts, a.last_attempt, t.max_attempts
+                 FROM tests t
+                 LEFT JOIN stats_student_test a ON a.test_id = t.id AND a.student_username = ?
+                 WHERE t.id = ?""",
+              (student_username, test_id))
+    attempts, last_attempt, max_attempts = c.fetchone() or (None, None, 0)
+    if max_attempts and (attempts or 0) >= max_attempts:
+        # Попытки исчерпаны: лишняя отправка не создает новую попытку
+        if session_id is not None:
+            c.execute("UPDATE test_sessions SET status = 'submitted', closed_at = ? WHERE id = ? AND status = 'active'",
+                      (time.time(), session_id))
+        raise SubmissionRejected("Попытки прохождения теста исчерпаны: ответы не засчитаны")
+
+    if session_id is not None:
+        # Время и статус попытки определяет сервер, а не клиент
+        now = now or time.time()
+        c.execute("""SELECT started_at, deadline, status FROM test_sessions
+                     WHERE id = ? AND test_id = ? AND student_username = ?""",
+                  (session_id, test_id, student_username))
+        session = c.fetchone()
+        if not session:
+            raise SubmissionRejected("Сессия тестирования не найдена: ответы не засчитаны")
+        if session[2] == 'expired':
+            # Сессию закрыла фоновая очистка: попытка уже записана без ответов
+            raise SubmissionRejected("Время на тест истекло до отправки: ответы не засчитаны")
+        if session[2] != 'active':
+            raise SubmissionRejected("Сессия тестирования уже завершена: ответы не засчитаны")
+
+        started_at, deadline = session[0], session[1]
+        status = 'submitted'
+        if now > deadline + SESSION_GRACE_PERIOD:
+            # Ответы пришли после дедлайна - попытка засчитывается как просроченная
+            answers, score, status = {}, 0, 'expired'
+            items = [dict(item, is_correct=False, points_awarded=0, answer=None) for item in items or []]
+        time_spent = int(min(now, deadline) - started_at)
+        c.execute("UPDATE test_sessions SET status = ?, closed_at = ? WHERE id = ?",
+                  (status, now, session_id))
+
+    # Сохраняем результат; уникальный индекс по номеру попытки страхует от дублей
+    c.execute("""INSERT INTO test_results (test_id, student_username, answers, score, max_score, time_spent,
+                                           attempt_number, submission_token)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+              (test_id, student_username, json.dumps(answers), score, max_score, time_spent,
+               (last_attempt or 0) + 1, submission_token))
+    if items:
+        _insert_result_items(c, c.lastrowid, items)
+
     return score, max_score
 
 
 def get_test_results(student_username: str, test_id: Optional[int] = None) -> List[Dict[str, Any]]:
     """Получение результатов тестов"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-
-    if test_id:
-        c.execute("""SELECT r.*, t.title 
-                     FROM test_results r 
-                     JOIN tests t ON r.test_id = t.id 
-                     WHERE r.student_username = ? AND r.test_id = ?
-                     ORDER BY r.completed_at DESC""",
-                  (student_username, test_id))
-    else:
-        c.execute("""SELECT r.*, t.title 
-                     FROM test_results r 
-                     JOIN tests t ON r.test_id = t.id 
-                     WHERE r.student_username = ? 
-                     ORDER BY r.completed_at DESC""",
-                  (student_username,))
-
-    results = []
-    for row in c.fetchall():
-        results.append({
-            'id': row[0],
-            'test_id': row[1],
-            'test_title': row[9],
-            'score': row[4],
-            'max_score': row[5],
-            'time_spent': row[6],
-            'completed_at': row[7],
-            'attempt_number': row[8]
-        })
+    columns = """r.id, r.test_id, r.student_username, r.answers, r.score, r.max_score,
+                 r.time_spent, r.completed_at, r.attempt_number, t.title"""
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+
+        if test_id:
+            c.execute(f"""SELECT {columns}
+                         FROM test_results r 
+                         JOIN tests t ON r.test_id = t.id 
+                         WHERE r.student_username = ? AND r.test_id = ?
+                         ORDER BY r.completed_at DESC""",
+                      (student_username, test_id))
+        else:
+            c.execute(f"""SELECT {columns}
+                         FROM test_results r 
+                         JOIN tests t ON r.test_id = t.id 
+                         WHERE r.student_username = ? 
+                         ORDER BY r.completed_at DESC""",
+                      (student_username,))
+
+        results = []
+        for row in c.fetchall():
+            results.append({
+                'id': row[0],
+                'test_id': row[1],
+                'test_title': row[9],
+                'score': row[4],
+                'max_score': row[5],
+                'time_spent': row[6],
+                'completed_at': row[7],
+                'attempt_number': row[8]
+            })
 
-    conn.close()
     return results
 
 
+@cached("test")
 def get_test_by_id(test_id: int) -> Optional[Dict[str, Any]]:
     """Получение теста по ID"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT * FROM tests WHERE id = ?", (test_id,))
-    row = c.fetchone()
-    conn.close()
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM tests WHERE id = ?", (test_id,))
+        row = c.fetchone()
 
     if row:
         return {
@@ -450,223 +1794,905 @@ def get_test_by_id(test_id: int) -> Optional[Dict[str, Any]]:
     return None
 
 
+# =============================================================================
+# СЕССИИ ТЕСТИРОВАНИЯ
+# =============================================================================
+
+def _session_row_to_dict(row: Tuple) -> Dict[str, Any]:
+    """Строка test_sessions в словарь с оставшимся временем"""
+    return {
+        'id': row[0],
+        'test_id': row[1],
+        'student_username': row[2],
+        'started_at': row[3],
+        'deadline': row[4],
+        'status': row[5],
+        'remaining': max(0.0, row[4] - time.time()) if row[5] == 'active' else 0.0
+    }
+
+
+def start_test_session(test_id: int, student_username: str) -> Dict[str, Any]:
+    """Открывает сессию теста или возвращает уже открытую (после перезагрузки страницы).
+
+    ValueError - если тест не найден, не активен или попытки исчерпаны.
+    """
+    columns = "id, test_id, student_username, started_at, deadline, status"
+    with DatabaseManager.transaction(immediate=True) as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT {columns} FROM test_sessions
+                      WHERE test_id = ? AND student_username = ? AND status = 'active'""",
+                  (test_id, student_username))
+        row = c.fetchone()
+        if row:
+            return _session_row_to_dict(row)
+
+        c.execute("""SELECT t.time_limit, t.is_active, t.max_attempts, COALESCE(a.attempts, 0)
+                     FROM tests t
+                     LEFT JOIN stats_student_test a ON a.test_id = t.id AND a.student_username = ?
+                     WHERE t.id = ?""", (student_username, test_id))
+        test = c.fetchone()
+        if not test or not test[1]:
+            raise ValueError("Тест не найден или недоступен")
+        time_limit, _, max_attempts, attempts = test
+        if max_attempts and attempts >= max_attempts:
+            raise ValueError("Попытки прохождения теста исчерпаны")
+
+        started_at = time.time()
+        c.execute("""INSERT INTO test_sessions (test_id, student_username, started_at, deadline)
+                     VALUES (?, ?, ?, ?)""",
+                  (test_id, student_username, started_at, started_at + time_limit * 60))
+        return _session_row_to_dict((c.lastrowid, test_id, student_username,
+                                     started_at, started_at + time_limit * 60, 'active'))
+
+
+def get_test_session(session_id: int) -> Optional[Dict[str, Any]]:
+    """Получение сессии теста по ID"""
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT id, test_id, student_username, started_at, deadline, status
+                     FROM test_sessions WHERE id = ?""", (session_id,))
+        row = c.fetchone()
+
+    return _session_row_to_dict(row) if row else None
+
+
+def expire_test_sessions(now: Optional[float] = None) -> int:
+    """Закрывает все просроченные сессии, записывая по ним нулевой результат"""
+    now = now or time.time()
+    with DatabaseManager.transaction(immediate=True) as conn:
+        c = conn.cursor()
+        c.execute("""SELECT s.id, s.test_id, s.student_username, t.total_points
+                     FROM test_sessions s
+                     JOIN tests t ON t.id = s.test_id
+                     WHERE s.status = 'active' AND s.deadline < ?""", (now - SESSION_GRACE_PERIOD,))
+        expired = c.fetchall()
+
+        # Как и при истечении времени в интерфейсе, попытка засчитывается без ответов;
+        # номер попытки и лимит max_attempts проверяет общий путь записи
+        for session_id, test_id, student_username, total_points in expired:
+            items = grade_answer_items(get_answer_key(test_id), {})
+            try:
+                _record_submission(c, test_id, student_username, {}, 0, total_points, 0, session_id,
+                                   items=items, now=now)
+            except SubmissionRejected:
+                # Попытки исчерпаны: сессия закрыта без новой попытки
+                pass
+        return len(expired)
+
+
+_sweeper_lock = threading.Lock()
+_sweeper_thread: Optional[threading.Thread] = None
+
+
+def _sweep_sessions_forever(interval: float):
+    """Цикл фоновой очистки просроченных сессий"""
+    while True:
+        try:
+            expired = expire_test_sessions()
+            if expired:
+                print(f"⏰ Закрыто просроченных сессий: {expired}")
+        except sqlite3.Error as e:
+            print(f"Ошибка очистки сессий: {e}")
+        time.sleep(interval)
+
+
+def start_session_sweeper(interval: Optional[float] = None) -> threading.Thread:
+    """Запускает (один раз на процесс) фоновую очистку просроченных сессий"""
+    global _sweeper_thread
+    with _sweeper_lock:
+        if _sweeper_thread is None or not _sweeper_thread.is_alive():
+            _sweeper_thread = threading.Thread(
+                target=_sweep_sessions_forever,
+                args=(interval or SESSION_SWEEP_INTERVAL,),
+                name="dblearn-session-sweeper",
+                daemon=True
+            )
+            _sweeper_thread.start()
+        return _sweeper_thread
+
+
+# =============================================================================
+# ОЧЕРЕДЬ ЗАПИСИ РЕЗУЛЬТАТОВ
+# =============================================================================
+
+class SubmissionWriter:
+    """Единственный поток записи результатов с групповым коммитом.
+
+    В конце экзамена все студенты отправляют ответы одновременно; вместо борьбы
+    за блокировку записи SQLite отправки копятся в очереди, и писатель сохраняет
+    все накопившиеся за время предыдущего коммита одной транзакцией.
+    """
+
+    def __init__(self, batch_size: int = WRITER_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Tuple[Tuple, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._recent: "deque[Tuple[float, int]]" = deque()  # (время коммита, записей) за минуту
+        self._counters = {"submitted": 0, "committed": 0, "rejected": 0, "failed": 0,
+                          "batches": 0, "max_batch": 0, "commit_seconds": 0.0}
+
+    def submit(self, *args) -> Future:
+        """Ставит аргументы _record_submission в очередь"""
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="dblearn-writer", daemon=True)
+                self._thread.start()
+            self._counters["submitted"] += 1
+        self._queue.put((args, future))
+        return future
+
+    def _collect(self) -> List[Tuple[Tuple, Future]]:
+        """Ждет первую отправку и забирает все, что накопилось следом"""
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(args, future) for args, future in self._collect()
+                     if future.set_running_or_notify_cancel()]
+            outcomes = []
+            started = time.monotonic()
+            try:
+                with DatabaseManager.transaction(immediate=True) as conn:
+                    c = conn.cursor()
+                    for args, future in batch:
+                        # Ошибка одной отправки не должна откатывать остальные
+                        c.execute("SAVEPOINT submission")
+                        try:
+                            outcomes.append((future, _record_submission(c, *args), None))
+                            c.execute("RELEASE submission")
+                        except SubmissionRejected as e:
+                            # Отказ сохраняет закрытие сессии, но попытку не записывает
+                            c.execute("RELEASE submission")
+                            outcomes.append((future, None, e))
+                        except Exception as e:
+                            c.execute("ROLLBACK TO submission")
+                            c.execute("RELEASE submission")
+                            outcomes.append((future, None, e))
+            except Exception as e:
+                outcomes = [(future, None, e) for _, future in batch]
+
+            elapsed = time.monotonic() - started
+            committed = sum(1 for _, _, error in outcomes if error is None)
+            rejected = sum(1 for _, _, error in outcomes if isinstance(error, SubmissionRejected))
+            with self._lock:
+                self._counters["committed"] += committed
+                self._counters["rejected"] += rejected
+                self._counters["failed"] += len(outcomes) - committed - rejected
+                self._counters["batches"] += 1
+                self._counters["max_batch"] = max(self._counters["max_batch"], len(outcomes))
+                self._counters["commit_seconds"] += elapsed
+                now = time.monotonic()
+                self._recent.append((now, committed))
+                while self._recent and self._recent[0][0] < now - 60:
+                    self._recent.popleft()
+
+            # Результаты отдаем только после коммита
+            for future, result, error in outcomes:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        """Пропускная способность, глубина очереди и размеры пакетов"""
+        with self._lock:
+            counters = dict(self._counters)
+            window = [count for moment, count in self._recent if moment >= time.monotonic() - 60]
+            running = self._thread is not None and self._thread.is_alive()
+        batches = counters.pop("batches")
+        commit_seconds = counters.pop("commit_seconds")
+        return {
+            **counters,
+            "queue_depth": self._queue.qsize(),
+            "batches": batches,
+            "avg_batch": round((counters["committed"] + counters["rejected"] + counters["failed"]) / batches, 1)
+            if batches else 0.0,
+            "avg_commit_ms": round(commit_seconds / batches * 1000, 1) if batches else 0.0,
+            "throughput_per_min": sum(window),
+            "running": running
+        }
+
+
+submission_writer = SubmissionWriter()
+
+
+def get_writer_stats() -> Dict[str, Any]:
+    """Статистика очереди записи результатов"""
+    return submission_writer.stats()
+
+
+# =============================================================================
+# ПЕРЕПРОВЕРКА РЕЗУЛЬТАТОВ
+# =============================================================================
+
+def update_answer_key(question_id: int, correct_answers: List[str]) -> bool:
+    """Исправляет правильные ответы вопроса; прошлые результаты пересчитывает regrade_test"""
+    with DatabaseManager.transaction() as conn:
+        c = conn.cursor()
+        c.execute("SELECT test_id FROM test_questions WHERE id = ?", (question_id,))
+        row = c.fetchone()
+        if not row:
+            return False
+        c.execute("""UPDATE test_answers SET correct_answers = ?, answer_hash = ?
+                     WHERE question_id = ?""",
+                  (json.dumps(correct_answers), hash_answer(correct_answers), question_id))
+        c.execute("UPDATE tests SET results_version = results_version + 1 WHERE id = ?", (row[0],))
+
+    _invalidate_test(row[0])
+    return True
+
+
+def _iter_result_chunks(test_id: int, chunk_size: int) -> Iterator[List[Tuple]]:
+    """Результаты теста порциями по id - без одной длинной транзакции чтения"""
+    last_id = 0
+    while True:
+        with DatabaseManager.connection() as conn:
+            c = conn.cursor()
+            c.execute("""SELECT id, student_username, attempt_number, completed_at, score, max_score, answers
+                         FROM test_results
+                         WHERE test_id = ? AND id > ?
+                         ORDER BY id
+                         LIMIT ?""", (test_id, last_id, chunk_size))
+            rows = c.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _regrade_chunk(answer_key: Dict[int, Dict[str, Any]], rows: List[Tuple]) -> List[Dict[str, Any]]:
+    """Проверка порции результатов по ключу (функция верхнего уровня для пула процессов)"""
+    regraded = []
+    for result_id, username, attempt_number, completed_at, score, max_score, answers in rows:
+        try:
+            answers = json.loads(answers) if answers else {}
+        except (TypeError, ValueError):
+            answers = {}
+        items = grade_answer_items(answer_key, answers if isinstance(answers, dict) else {})
+        regraded.append({
+            'result_id': result_id,
+            'student_username': username,
+            'attempt_number': attempt_number,
+            'completed_at': completed_at,
+            'old_score': score,
+            'new_score': sum(item['points_awarded'] for item in items),
+            'old_max_score': max_score,
+            'new_max_score': sum(item['max_points'] for item in items),
+            'items': items
+        })
+    return regraded
+
+
+def _apply_regrade(test_id: int, regraded: List[Dict[str, Any]]):
+    """Пакетная запись новых баллов и проверки по вопросам одной короткой транзакцией"""
+    changed = [result for result in regraded
+               if (result['old_score'], result['old_max_score']) != (result['new_score'], result['new_max_score'])]
+    result_ids = [result['result_id'] for result in regraded]
+    placeholders = ','.join('?' for _ in result_ids)
+
+    with DatabaseManager.transaction(immediate=True) as conn:
+        c = conn.cursor()
+        # Построчный пересчет сводных таблиц откладываем и делаем один раз на порцию;
+        # снимок рейтинга по-прежнему помечается устаревшим триггером версии
+        c.execute("UPDATE stats_meta SET value = 1 WHERE name = 'summary_deferred'")
+        c.executemany("UPDATE test_results SET score = ?, max_score = ? WHERE id = ?",
+                      [(result['new_score'], result['new_max_score'], result['result_id']) for result in changed])
+        c.execute("UPDATE stats_meta SET value = 0 WHERE name = 'summary_deferred'")
+        if changed:
+            _refresh_summary_rows(c, [result['result_id'] for result in changed])
+        c.execute(f"DELETE FROM test_result_items WHERE result_id IN ({placeholders})", result_ids)
+        for result in regraded:
+            _insert_result_items(c, result['result_id'], result['items'])
+        # Ответы по вопросам переписаны - анализ заданий теста устарел, даже если баллы те же
+        c.execute("UPDATE tests SET results_version = results_version + 1 WHERE id = ?", (test_id,))
+
+
+def regrade_test(test_id: int, chunk_size: int = REGRADE_CHUNK, workers: Optional[int] = None,
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 dry_run: bool = False) -> Dict[str, Any]:
+    """Перепроверяет все результаты теста по текущему ключу ответов.
+
+    Результаты читаются порциями, проверяются (на больших тестах - в пуле процессов,
+    workers=1 - в текущем потоке) и записываются пакетами. Возвращает список изменившихся баллов.
+    """
+    chunk_size = min(chunk_size, SQL_IN_CHUNK)
+    answer_key = get_answer_key.uncached(test_id)
+    with DatabaseManager.connection() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM test_results WHERE test_id = ?", (test_id,)).fetchone()[0]
+
+    report = {'test_id': test_id, 'total': total, 'processed': 0, 'changed': [], 'dry_run': dry_run}
+    started = time.monotonic()
+
+    def collect(regraded: List[Dict[str, Any]]):
+        if not dry_run:
+            _apply_regrade(test_id, regraded)
+        for result in regraded:
+            if (result['old_score'], result['old_max_score']) != (result['new_score'], result['new_max_score']):
+                report['changed'].append({key: value for key, value in result.items() if key != 'items'})
+        report['processed'] += len(regraded)
+        if progress:
+            progress(report['processed'], total)
+
+    if total <= chunk_size or workers == 1:
+        for rows in _iter_result_chunks(test_id, chunk_size):
+            collect(_regrade_chunk(answer_key, rows))
+    else:
+        # spawn, а не fork: процесс-родитель может держать потоки записи и соединения SQLite
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # Не держим в памяти больше нескольких порций на процесс
+            limit = (workers or os.cpu_count() or 1) * 2
+            pending = []
+            for rows in _iter_result_chunks(test_id, chunk_size):
+                pending.append(pool.submit(_regrade_chunk, answer_key, rows))
+                if len(pending) >= limit:
+                    collect(pending.pop(0).result())
+            for future in pending:
+                collect(future.result())
+
+    report['elapsed'] = round(time.monotonic() - started, 2)
+    return report
+
+
+# =============================================================================
+# ВЫГРУЗКА РЕЗУЛЬТАТОВ
+# =============================================================================
+
+EXPORT_COLUMNS = ["result_id", "test_id", "test_title", "student_username", "full_name", "group_name",
+                  "attempt_number", "score", "max_score", "percent", "time_spent", "completed_at"]
+
+# Формат выгрузки: MIME-тип и кодировка (BOM в CSV - чтобы Excel распознал UTF-8)
+EXPORT_FORMATS = {
+    "csv": {"mime": "text/csv", "encoding": "utf-8-sig"},
+    "jsonl": {"mime": "application/x-ndjson", "encoding": "utf-8"},
+}
+
+
+def iter_results_export(test_id: Optional[int] = None, group_name: Optional[str] = None,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        created_by: Optional[str] = None,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[tuple]]:
+    """Результаты порциями по batch_size строк из одного снимка БД.
+
+    Курсор SQLite выбирает строки по мере fetchmany, поэтому в памяти
+    одновременно только одна порция. Границы диапазона дат включаются.
+    """
+    conditions, params = [], []
+    if created_by is not None:
+        conditions.append("t.created_by = ?")
+        params.append(created_by)
+    if test_id is not None:
+        conditions.append("r.test_id = ?")
+        params.append(test_id)
+    if group_name is not None:
+        conditions.append("u.group_name = ?")
+        params.append(group_name)
+    if date_from is not None:
+        conditions.append("r.completed_at >= ?")
+        params.append(str(date_from))
+    if date_to is not None:
+        conditions.append("r.completed_at < DATE(?, '+1 day')")
+        params.append(str(date_to))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with DatabaseManager.snapshot(READ_ROUTES.get("iter_results_export", "analytics")) as conn:
+        c = conn.cursor()
+        # Порядок по id совпадает с порядком хранения - строки отдаются без сортировки
+        c.execute(f"""
+            SELECT 
+                r.id,
+                r.test_id,
+                t.title,
+                r.student_username,
+                u.full_name,
+                u.group_name,
+                r.attempt_number,
+                r.score,
+                r.max_score,
+                ROUND(r.score * 100.0 / NULLIF(r.max_score, 0), 1),
+                r.time_spent,
+                r.completed_at
+            FROM test_results r
+            JOIN tests t ON t.id = r.test_id
+            LEFT JOIN users u ON u.username = r.student_username
+            {where}
+            ORDER BY r.id
+        """, params)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def export_results(fmt: str = "csv", **filters) -> Iterator[str]:
+    """Текст выгрузки по частям: заголовок и по одной части на порцию строк"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    batches = iter_results_export(**filters)
+
+    if fmt == "jsonl":
+        return (
+            "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+            for rows in batches
+        )
+
+    def csv_chunks() -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    return csv_chunks()
+
+
+def write_results_export(f: BinaryIO, fmt: str = "csv", **filters) -> int:
+    """Записывает выгрузку в двоичный файл по мере чтения, возвращает число байт"""
+    encoder = codecs.getincrementalencoder(EXPORT_FORMATS.get(fmt, {}).get("encoding", "utf-8"))()
+    written = 0
+    for chunk in export_results(fmt, **filters):
+        data = encoder.encode(chunk)
+        f.write(data)
+        written += len(data)
+    return written
+
+
 # =============================================================================
 # ФУНКЦИИ АНАЛИТИКИ И СТАТИСТИКИ
 # =============================================================================
 
-def get_group_statistics(group_name: str) -> Optional[Dict[str, Any]]:
-    """Статистика по группе"""
-    try:
-        conn = DatabaseManager.get_connection()
-        c = conn.cursor()
-        
-        # Получаем студентов группы
-        c.execute("SELECT username FROM users WHERE role = 'Студент' AND group_name = ?", (group_name,))
-        students = [row[0] for row in c.fetchall()]
-        
-        if not students:
-            conn.close()
-            return None
-        
-        # Статистика по тестам
-        placeholders = ','.join('?' for _ in students)
+@routed
+def get_students_statistics(usernames: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Успеваемость набора студентов (например, страницы списка) одним запросом"""
+    statistics = {
+        username: {
+            'tests_completed': 0,
+            'attempts': 0,
+            'avg_success_rate': 0.0,
+            'best_success_rate': 0.0,
+            'total_time_spent': 0,
+            'recent_attempts': 0,
+            'last_test_title': None,
+            'last_activity': None
+        } for username in usernames
+    }
+    if not usernames:
+        return statistics
+
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        for start in range(0, len(usernames), SQL_IN_CHUNK):
+            chunk = usernames[start:start + SQL_IN_CHUNK]
+            placeholders = ','.join('?' for _ in chunk)
+            c.execute(f"""
+                SELECT 
+                    r.student_username,
+                    COUNT(DISTINCT r.test_id) as tests_completed,
+                    COUNT(*) as attempts,
+                    AVG(r.score * 100.0 / r.max_score) as avg_success_rate,
+                    MAX(r.score * 100.0 / r.max_score) as best_success_rate,
+                    SUM(r.time_spent) as total_time_spent,
+                    SUM(CASE WHEN r.completed_at >= DATETIME('now', '-30 days') THEN 1 ELSE 0 END) as recent_attempts,
+                    MAX(r.completed_at) as last_activity,
+                    (SELECT t.title
+                     FROM test_results last
+                     JOIN tests t ON t.id = last.test_id
+                     WHERE last.student_username = r.student_username
+                     ORDER BY last.completed_at DESC, last.id DESC
+                     LIMIT 1) as last_test_title
+                FROM test_results r
+                WHERE r.student_username IN ({placeholders})
+                GROUP BY r.student_username
+            """, chunk)
+
+            for row in c.fetchall():
+                statistics[row[0]] = {
+                    'tests_completed': row[1],
+                    'attempts': row[2],
+                    'avg_success_rate': round(row[3] or 0, 1),
+                    'best_success_rate': round(row[4] or 0, 1),
+                    'total_time_spent': row[5] or 0,
+                    'recent_attempts': row[6],
+                    'last_activity': row[7],
+                    'last_test_title': row[8]
+                }
+
+    return statistics
+
+
+# Начало периода для укрупнения дневной статистики (неделя - с понедельника)
+PROGRESS_PERIODS = {
+    "day": "day",
+    "week": "DATE(day, '-6 days', 'weekday 1')",
+    "month": "DATE(day, 'start of month')",
+}
+
+
+def _progress_filter(date_from: Optional[str], date_to: Optional[str]) -> Tuple[str, List[str]]:
+    """Условие по диапазону дат (включительно) для stats_student_day"""
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append("AND d.day >= ?")
+        params.append(str(date_from))
+    if date_to is not None:
+        conditions.append("AND d.day <= ?")
+        params.append(str(date_to))
+    return " ".join(conditions), params
+
+
+def _quantile(values: List[float], q: float) -> float:
+    """Квантиль с линейной интерполяцией (как numpy.percentile)"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+@routed
+def get_student_progress(student_username: str, date_from: Optional[str] = None,
+                         date_to: Optional[str] = None, period: str = "day") -> List[Dict[str, Any]]:
+    """Прогресс студента по дням, неделям или месяцам (date - начало периода)"""
+    period_sql = PROGRESS_PERIODS[period]
+    date_filter, date_params = _progress_filter(date_from, date_to)
+
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        # Диапазон дат - поиск по первичному ключу (student_username, day)
         c.execute(f"""
             SELECT 
-                COUNT(DISTINCT test_id) as total_tests,
-                COUNT(*) as total_attempts,
-                AVG(score * 100.0 / max_score) as avg_success_rate,
-                MAX(score * 100.0 / max_score) as max_success_rate,
-                MIN(score * 100.0 / max_score) as min_success_rate
-            FROM test_results 
-            WHERE student_username IN ({placeholders})
-        """, students)
-        
-        stats = c.fetchone()
-        
-        # Распределение оценок
+                {period_sql} as period,
+                SUM(d.percent_sum) / NULLIF(SUM(d.percent_count), 0) as daily_avg,
+                SUM(d.attempts) as tests_taken
+            FROM stats_student_day d
+            WHERE d.student_username = ? {date_filter}
+            GROUP BY period
+            ORDER BY period
+        """, [student_username] + date_params)
+
+        progress_data = []
+        for row in c.fetchall():
+            progress_data.append({
+                'date': row[0],
+                'daily_avg': round(row[1] or 0, 1),
+                'tests_taken': row[2]
+            })
+
+    return progress_data
+
+
+@routed
+def get_group_progress(group_name: str, date_from: Optional[str] = None,
+                       date_to: Optional[str] = None, period: str = "week") -> Dict[str, Any]:
+    """Кривые прогресса всех студентов группы одним запросом и медиана группы по периодам.
+
+    Медиана и квартили считаются по средним процентам студентов, проходивших тесты в периоде.
+    """
+    period_sql = PROGRESS_PERIODS[period]
+    date_filter, date_params = _progress_filter(date_from, date_to)
+
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
         c.execute(f"""
             SELECT 
-                CASE 
-                    WHEN score * 100.0 / max_score >= 90 THEN '90-100%'
-                    WHEN score * 100.0 / max_score >= 80 THEN '80-89%'
-                    WHEN score * 100.0 / max_score >= 70 THEN '70-79%'
-                    WHEN score * 100.0 / max_score >= 60 THEN '60-69%'
-                    ELSE '0-59%'
-                END as grade_range,
-                COUNT(*) as count
-            FROM test_results 
-            WHERE student_username IN ({placeholders})
-            GROUP BY grade_range
-            ORDER BY grade_range
-        """, students)
-        
-        grade_distribution = {row[0]: row[1] for row in c.fetchall()}
-        
-        conn.close()
-        
-        return {
-            'group_name': group_name,
-            'student_count': len(students),
-            'total_tests': stats[0] or 0,
-            'total_attempts': stats[1] or 0,
-            'avg_success_rate': round(stats[2] or 0, 1),
-            'max_success_rate': round(stats[3] or 0, 1),
-            'min_success_rate': round(stats[4] or 0, 1),
-            'grade_distribution': grade_distribution
+                d.student_username,
+                {period_sql} as period,
+                SUM(d.percent_sum) / NULLIF(SUM(d.percent_count), 0) as avg_percent,
+                SUM(d.attempts) as tests_taken
+            FROM users u
+            JOIN stats_student_day d ON d.student_username = u.username {date_filter}
+            WHERE u.role = 'Студент' AND u.group_name = ?
+            GROUP BY d.student_username, period
+            ORDER BY period, d.student_username
+        """, date_params + [group_name])
+
+        students: Dict[str, List[Dict[str, Any]]] = {}
+        by_period: Dict[str, List[float]] = {}
+        for row in c.fetchall():
+            students.setdefault(row[0], []).append({
+                'date': row[1],
+                'daily_avg': round(row[2] or 0, 1),
+                'tests_taken': row[3]
+            })
+            if row[2] is not None:
+                by_period.setdefault(row[1], []).append(row[2])
+
+    median = [
+        {
+            'date': date,
+            'median': round(_quantile(values, 0.5), 1),
+            'p25': round(_quantile(values, 0.25), 1),
+            'p75': round(_quantile(values, 0.75), 1),
+            'students': len(values)
         }
-    except Exception as e:
-        print(f"Ошибка в get_group_statistics: {e}")
-        return None
+        for date, values in by_period.items()
+    ]
+    return {'group_name': group_name, 'period': period, 'students': students, 'median': median}
 
 
-def get_student_progress(student_username: str) -> List[Dict[str, Any]]:
-    """Прогресс студента"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("""
-        SELECT 
-            DATE(completed_at) as date,
-            AVG(score * 100.0 / max_score) as daily_avg,
-            COUNT(*) as tests_taken
-        FROM test_results 
-        WHERE student_username = ?
-        GROUP BY DATE(completed_at)
-        ORDER BY date
-    """, (student_username,))
-    
-    progress_data = []
-    for row in c.fetchall():
-        progress_data.append({
-            'date': row[0],
-            'daily_avg': round(row[1], 1),
-            'tests_taken': row[2]
-        })
-    
-    conn.close()
-    return progress_data
+@routed
+def get_question_statistics(test_id: int) -> List[Dict[str, Any]]:
+    """Статистика по вопросам теста: индекс трудности, процент успеха, средний балл и время"""
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT 
+                q.id,
+                q.question_order,
+                q.question_text,
+                q.question_type,
+                q.points,
+                COUNT(i.question_id) as attempts,
+                SUM(CASE WHEN i.answer IS NOT NULL THEN 1 ELSE 0 END) as answered,
+                SUM(i.is_correct) as correct,
+                AVG(i.is_correct) as difficulty_index,
+                AVG(i.points_awarded) as avg_points,
+                AVG(i.time_spent) as avg_time_spent
+            FROM test_questions q
+            LEFT JOIN test_result_items i ON i.question_id = q.id
+            WHERE q.test_id = ?
+            GROUP BY q.id
+            ORDER BY q.question_order, q.id
+        """, (test_id,))
+
+        statistics = []
+        for row in c.fetchall():
+            statistics.append({
+                'question_id': row[0],
+                'question_order': row[1],
+                'question_text': row[2],
+                'question_type': row[3],
+                'points': row[4],
+                'attempts': row[5],
+                'answered': row[6] or 0,
+                'correct': row[7] or 0,
+                # Классический индекс трудности p: доля верных ответов (чем выше, тем легче)
+                'difficulty_index': round(row[8], 3) if row[8] is not None else None,
+                'success_rate': round(row[8] * 100, 1) if row[8] is not None else 0.0,
+                'avg_points': round(row[9] or 0, 2),
+                # Время по вопросам интерфейс пока не передает
+                'avg_time_spent': round(row[10], 1) if row[10] is not None else None
+            })
+
+    return statistics
+
+
+@routed
+def get_option_statistics(test_id: int) -> List[Dict[str, Any]]:
+    """Анализ дистракторов: сколько раз выбран каждый вариант вопросов с выбором ответа.
+
+    Ответы разбираются в SQLite через json_each: для single_choice ответ - строка
+    (json_each вернет одну строку), для multiple_choice - массив выбранных вариантов.
+    """
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            WITH choice_questions AS (
+                SELECT id, question_order, question_text, question_type, options
+                FROM test_questions
+                WHERE test_id = ? AND question_type IN ('single_choice', 'multiple_choice')
+            ),
+            chosen AS (
+                SELECT i.question_id, a.value as option, COUNT(*) as times
+                FROM choice_questions q
+                JOIN test_result_items i ON i.question_id = q.id
+                JOIN json_each(i.answer) a
+                WHERE i.answer IS NOT NULL
+                GROUP BY i.question_id, a.value
+            ),
+            responses AS (
+                SELECT i.question_id,
+                       COUNT(*) as attempts,
+                       SUM(CASE WHEN i.answer IS NOT NULL THEN 1 ELSE 0 END) as answered
+                FROM choice_questions q
+                JOIN test_result_items i ON i.question_id = q.id
+                GROUP BY i.question_id
+            )
+            SELECT
+                q.id,
+                q.question_order,
+                q.question_text,
+                q.question_type,
+                o.key as option_index,
+                o.value as option_text,
+                COALESCE(ch.times, 0) as times,
+                EXISTS (SELECT 1 FROM test_answers ta, json_each(ta.correct_answers) k
+                        WHERE ta.question_id = q.id AND k.value = o.value) as is_correct,
+                COALESCE(r.attempts, 0),
+                COALESCE(r.answered, 0)
+            FROM choice_questions q
+            JOIN json_each(q.options) o
+            LEFT JOIN chosen ch ON ch.question_id = q.id AND ch.option = o.value
+            LEFT JOIN responses r ON r.question_id = q.id
+            ORDER BY q.question_order, q.id, o.key
+        """, (test_id,))
+
+        questions: Dict[int, Dict[str, Any]] = {}
+        for row in c.fetchall():
+            question = questions.setdefault(row[0], {
+                'question_id': row[0],
+                'question_order': row[1],
+                'question_text': row[2],
+                'question_type': row[3],
+                'attempts': row[8],
+                'answered': row[9],
+                'options': []
+            })
+            question['options'].append({
+                'option': row[5],
+                'times': row[6],
+                'is_correct': bool(row[7]),
+                # Доля ответивших на вопрос, выбравших вариант
+                'share': round(row[6] * 100.0 / row[9], 1) if row[9] else 0.0
+            })
+
+    return list(questions.values())
+
+
+_ranking_checked_at = 0.0
+
+
+def _ranking_versions(c: sqlite3.Cursor) -> Dict[str, int]:
+    c.execute("SELECT name, value FROM stats_meta WHERE name IN ('results_version', 'ranking_version')")
+    return dict(c.fetchall())
+
+
+def refresh_ranking_snapshot(force: bool = False) -> bool:
+    """Пересчитывает снимок рейтинга оконными функциями, если результаты изменились"""
+    # Версии читаем через основной пул: снимок аналитики не должен начаться до пересчета
+    with DatabaseManager.connection("default") as conn:
+        versions = _ranking_versions(conn.cursor())
+    if not force and versions.get('ranking_version') == versions.get('results_version'):
+        return False
 
+    with DatabaseManager.transaction(immediate=True) as conn:
+        c = conn.cursor()
+        # Снимок мог обновить другой сеанс, пока ждали блокировку
+        versions = _ranking_versions(c)
+        if not force and versions.get('ranking_version') == versions.get('results_version'):
+            return False
+
+        c.execute("DELETE FROM ranking_snapshot")
+        c.execute("""
+            INSERT INTO ranking_snapshot (username, full_name, group_name, tests_completed,
+                                          avg_percent, total_points, global_rank, group_rank)
+            SELECT 
+                u.username,
+                u.full_name,
+                u.group_name,
+                s.attempts,
+                s.avg_percent,
+                s.total_score,
+                RANK() OVER (ORDER BY COALESCE(s.avg_percent, 0) DESC),
+                RANK() OVER (PARTITION BY u.group_name ORDER BY COALESCE(s.avg_percent, 0) DESC)
+            FROM stats_student s
+            JOIN users u ON u.username = s.student_username
+            WHERE u.role = 'Студент' AND s.attempts > 0
+        """)
+        c.execute("UPDATE stats_meta SET value = ? WHERE name = 'ranking_version'",
+                  (versions.get('results_version', 0),))
+    return True
 
-def get_test_analytics(test_id: int) -> Dict[str, Any]:
-    """Аналитика по тесту"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    # Основная статистика
-    c.execute("""
-        SELECT 
-            COUNT(*) as total_attempts,
-            AVG(score) as avg_score,
-            MAX(score) as max_score_achieved,
-            MIN(score) as min_score_achieved,
-            AVG(time_spent) as avg_time_spent,
-            AVG(score * 100.0 / max_score) as avg_success_rate
-        FROM test_results 
-        WHERE test_id = ?
-    """, (test_id,))
-    
-    stats = c.fetchone()
-    
-    # Информация о тесте
-    c.execute("SELECT title, description FROM tests WHERE id = ?", (test_id,))
-    test_info = c.fetchone()
-    
-    # Количество вопросов
-    c.execute("SELECT COUNT(*) FROM test_questions WHERE test_id = ?", (test_id,))
-    question_count = c.fetchone()[0]
-    
-    # Распределение оценок
-    c.execute("""
-        SELECT 
-            CASE 
-                WHEN score * 100.0 / max_score >= 90 THEN '90-100%'
-                WHEN score * 100.0 / max_score >= 80 THEN '80-89%'
-                WHEN score * 100.0 / max_score >= 70 THEN '70-79%'
-                WHEN score * 100.0 / max_score >= 60 THEN '60-69%'
-                ELSE '0-59%'
-            END as grade_range,
-            COUNT(*) as count
-        FROM test_results 
-        WHERE test_id = ?
-        GROUP BY grade_range
-        ORDER BY grade_range
-    """, (test_id,))
-    
-    grade_distribution = {row[0]: row[1] for row in c.fetchall()}
-    
-    conn.close()
-    
-    return {
-        'test_id': test_id,
-        'title': test_info[0] if test_info else "Неизвестный тест",
-        'description': test_info[1] if test_info else "",
-        'question_count': question_count,
-        'total_attempts': stats[0] or 0,
-        'avg_score': round(stats[1] or 0, 1),
-        'max_score_achieved': stats[2] or 0,
-        'min_score_achieved': stats[3] or 0,
-        'avg_time_spent': round(stats[4] or 0, 1),
-        'avg_success_rate': round(stats[5] or 0, 1),
-        'grade_distribution': grade_distribution
-    }
 
+def _ensure_ranking_snapshot():
+    """Проверяет актуальность снимка не чаще раза в RANKING_REFRESH_INTERVAL секунд"""
+    global _ranking_checked_at
+    now = time.monotonic()
+    if now - _ranking_checked_at >= RANKING_REFRESH_INTERVAL:
+        _ranking_checked_at = now
+        refresh_ranking_snapshot()
+
+
+@routed
+def get_leaderboard(group_name: Optional[str] = None, limit: int = 20,
+                    cursor: Optional[Tuple[int, str]] = None) -> Dict[str, Any]:
+    """Страница рейтинга: общего или внутри группы.
+
+    Студенты с одинаковым средним процентом делят место (RANK). cursor - пара
+    (место, логин) последней строки предыдущей страницы; следующая страница
+    читается по индексу без OFFSET. Возвращает {'rows': [...], 'next_cursor': ...}.
+    """
+    _ensure_ranking_snapshot()
+
+    rank_column = "group_rank" if group_name is not None else "global_rank"
+    conditions = []
+    params: List[Any] = []
+    if group_name is not None:
+        conditions.append("group_name = ?")
+        params.append(group_name)
+    if cursor is not None:
+        conditions.append(f"({rank_column}, username) > (?, ?)")
+        params.extend(cursor)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""
+            SELECT {rank_column}, username, full_name, group_name, tests_completed,
+                   avg_percent, total_points, global_rank, group_rank
+            FROM ranking_snapshot
+            {where}
+            ORDER BY {rank_column}, username
+            LIMIT ?
+        """, params + [limit + 1])
+        rows = c.fetchall()
 
-def get_student_ranking() -> List[Dict[str, Any]]:
-    """Рейтинг студентов"""
-    conn = DatabaseManager.get_connection()
-    c = conn.cursor()
-    
-    c.execute("""
-        SELECT 
-            u.username,
-            u.full_name,
-            u.group_name,
-            COUNT(r.id) as tests_completed,
-            AVG(r.score * 100.0 / r.max_score) as avg_success_rate,
-            SUM(r.score) as total_points
-        FROM users u
-        LEFT JOIN test_results r ON u.username = r.student_username
-        WHERE u.role = 'Студент'
-        GROUP BY u.username
-        HAVING tests_completed > 0
-        ORDER BY avg_success_rate DESC
-        LIMIT 20
-    """)
-    
     ranking = []
-    for i, row in enumerate(c.fetchall(), 1):
+    for row in rows[:limit]:
         ranking.append({
-            'rank': i,
-            'username': row[0],
-            'full_name': row[1],
-            'group': row[2],
-            'tests_completed': row[3],
-            'avg_success_rate': round(row[4] or 0, 1),
-            'total_points': row[5] or 0
+            'rank': row[0],
+            'username': row[1],
+            'full_name': row[2],
+            'group': row[3],
+            'tests_completed': row[4],
+            'avg_success_rate': round(row[5] or 0, 1),
+            'total_points': row[6] or 0,
+            'global_rank': row[7],
+            'group_rank': row[8]
         })
-    
-    conn.close()
-    return ranking
+
+    next_cursor = (ranking[-1]['rank'], ranking[-1]['username']) if len(rows) > limit else None
+    return {'rows': ranking, 'next_cursor': next_cursor}
+
+
+@routed
+def get_ranking_groups() -> List[str]:
+    """Группы, в которых есть студенты с результатами"""
+    _ensure_ranking_snapshot()
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT DISTINCT group_name FROM ranking_snapshot WHERE group_name IS NOT NULL ORDER BY group_name")
+        return [row[0] for row in c.fetchall()]
 
 
+@routed
 def get_teacher_dashboard_stats(teacher_username: str) -> Dict[str, Any]:
     """Статистика для дашборда преподавателя"""
     try:
-        conn = DatabaseManager.get_connection()
-        c = conn.cursor()
-        
-        c.execute("""
-            SELECT 
-                COUNT(DISTINCT id) as total_tests,
-                (SELECT COUNT(DISTINCT username) FROM users WHERE role = 'Студент') as total_students,
-                (SELECT COUNT(DISTINCT group_name) FROM users WHERE role = 'Студент' AND group_name IS NOT NULL) as total_groups
-            FROM tests 
-            WHERE created_by = ?
-        """, (teacher_username,))
-        
-        metrics = c.fetchone()
-        conn.close()
-        
+        with DatabaseManager.connection() as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT 
+                    COUNT(DISTINCT id) as total_tests,
+                    (SELECT COUNT(DISTINCT username) FROM users WHERE role = 'Студент') as total_students,
+                    (SELECT COUNT(DISTINCT group_name) FROM users WHERE role = 'Студент' AND group_name IS NOT NULL) as total_groups
+                FROM tests 
+                WHERE created_by = ?
+            """, (teacher_username,))
+            metrics = c.fetchone()
+
         return {
             'total_tests': metrics[0] or 0,
             'total_students': metrics[1] or 0,
@@ -678,4 +2704,4 @@ def get_teacher_dashboard_stats(teacher_username: str) -> Dict[str, Any]:
             'total_tests': 0,
             'total_students': 0,
             'total_groups': 0
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,192 @@
+"""Психометрический анализ заданий теста на NumPy: трудность, дискриминативность, надежность"""
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+from data.db_manager import DatabaseManager, cached, routed, get_test_questions
+
+# Доля сильных и слабых студентов для индекса дискриминативности (классические 27%)
+GROUP_FRACTION = 0.27
+
+# Пороги, по которым задание помечается как проблемное
+DIFFICULTY_RANGE = (0.2, 0.9)
+MIN_DISCRIMINATION = 0.2
+MIN_POINT_BISERIAL = 0.2
+
+
+# =============================================================================
+# МАТРИЦА ОТВЕТОВ
+# =============================================================================
+
+def load_response_matrix(test_id: int) -> Dict[str, Any]:
+    """Матрица студенты x вопросы с баллами за первую попытку каждого студента.
+
+    Берется первая попытка: повторные искажают показатели эффектом запоминания.
+    Вопрос без сохраненного ответа (добавлен после попытки) считается за 0 баллов.
+    """
+    questions = get_test_questions(test_id)
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT r.student_username, i.question_id, i.points_awarded
+            FROM test_results r
+            JOIN (SELECT student_username, MIN(attempt_number) as attempt_number
+                  FROM test_results
+                  WHERE test_id = ?
+                  GROUP BY student_username) f
+              ON f.student_username = r.student_username AND f.attempt_number = r.attempt_number
+            LEFT JOIN test_result_items i ON i.result_id = r.id
+            WHERE r.test_id = ?
+        """, (test_id, test_id))
+        rows = c.fetchall()
+
+    columns = {question['id']: j for j, question in enumerate(questions)}
+    usernames = np.array([row[0] for row in rows], dtype=object)
+    students, student_rows = np.unique(usernames, return_inverse=True)
+    question_cols = np.array([columns.get(row[1], -1) for row in rows], dtype=int)
+    points = np.array([row[2] or 0 for row in rows], dtype=float)
+
+    matrix = np.zeros((len(students), len(questions)))
+    known = question_cols >= 0
+    matrix[student_rows[known], question_cols[known]] = points[known]
+    return {
+        "students": students.tolist(),
+        "questions": questions,
+        "max_points": np.array([question['points'] or 0 for question in questions], dtype=float),
+        "matrix": matrix,
+    }
+
+
+# =============================================================================
+# ПОКАЗАТЕЛИ ЗАДАНИЙ
+# =============================================================================
+
+def _column_correlation(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Корреляция Пирсона между одноименными столбцами двух матриц (NaN при нулевой дисперсии)"""
+    xc = x - x.mean(axis=0)
+    yc = y - y.mean(axis=0)
+    denominator = np.sqrt((xc ** 2).sum(axis=0) * (yc ** 2).sum(axis=0))
+    return np.divide((xc * yc).sum(axis=0), denominator,
+                     out=np.full(x.shape[1], np.nan), where=denominator > 0)
+
+
+def cronbach_alpha(matrix: np.ndarray) -> float:
+    """Альфа Кронбаха: k/(k-1) * (1 - сумма дисперсий заданий / дисперсия суммы)"""
+    students, items = matrix.shape
+    if students < 2 or items < 2:
+        return float("nan")
+    total_variance = matrix.sum(axis=1).var(ddof=1)
+    if total_variance == 0:
+        return float("nan")
+    return float(items / (items - 1) * (1 - matrix.var(axis=0, ddof=1).sum() / total_variance))
+
+
+def analyze_items(matrix: np.ndarray, max_points: np.ndarray) -> Dict[str, Any]:
+    """Показатели всех заданий по матрице баллов студенты x вопросы.
+
+    difficulty - средняя доля балла (p), discrimination - разность p верхних и нижних 27%,
+    point_biserial - корреляция задания с суммой остальных заданий (скорректированная),
+    alpha_if_deleted - альфа Кронбаха без задания.
+    """
+    students, items = matrix.shape
+    nan = np.full(items, np.nan)
+    if students == 0:
+        return {"difficulty": nan, "discrimination": nan, "point_biserial": nan,
+                "alpha_if_deleted": nan, "alpha": float("nan")}
+
+    scaled = matrix / np.where(max_points > 0, max_points, 1)
+    totals = matrix.sum(axis=1)
+    difficulty = scaled.mean(axis=0)
+
+    # Верхняя и нижняя группы по общему баллу
+    group_size = max(1, int(round(students * GROUP_FRACTION)))
+    order = np.argsort(totals, kind="stable")
+    discrimination = scaled[order[-group_size:]].mean(axis=0) - scaled[order[:group_size]].mean(axis=0)
+
+    # Сумма остальных заданий для каждого задания: столбец j = totals - matrix[:, j]
+    rest = totals[:, None] - matrix
+    point_biserial = _column_correlation(matrix, rest)
+
+    alpha_if_deleted = nan
+    if students >= 2 and items >= 3:
+        item_variance = matrix.var(axis=0, ddof=1)
+        rest_variance = rest.var(axis=0, ddof=1)
+        alpha_if_deleted = np.divide(
+            (items - 1) / (items - 2) * (rest_variance - (item_variance.sum() - item_variance)),
+            rest_variance, out=np.full(items, np.nan), where=rest_variance > 0)
+
+    return {
+        "difficulty": difficulty,
+        "discrimination": discrimination,
+        "point_biserial": point_biserial,
+        "alpha_if_deleted": alpha_if_deleted,
+        "alpha": cronbach_alpha(matrix),
+    }
+
+
+def _round(value: float, digits: int = 3) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def _item_flags(difficulty: float, discrimination: float, point_biserial: float,
+                alpha_if_deleted: float, alpha: float) -> List[str]:
+    """Причины, по которым задание стоит проверить"""
+    flags = []
+    if difficulty < DIFFICULTY_RANGE[0]:
+        flags.append("слишком сложное")
+    elif difficulty > DIFFICULTY_RANGE[1]:
+        flags.append("слишком легкое")
+    if discrimination < MIN_DISCRIMINATION:
+        flags.append("слабо различает студентов")
+    if point_biserial < 0:
+        flags.append("отрицательная корреляция (проверьте ключ)")
+    elif point_biserial < MIN_POINT_BISERIAL:
+        flags.append("низкая корреляция с тестом")
+    if alpha_if_deleted > alpha:
+        flags.append("без задания надежность выше")
+    return flags
+
+
+# =============================================================================
+# АНАЛИЗ ТЕСТА (С КЕШЕМ)
+# =============================================================================
+
+@routed
+def get_item_analysis(test_id: int) -> Dict[str, Any]:
+    """Анализ заданий теста; пересчитывается только после изменения результатов, ключа или вопросов"""
+    with DatabaseManager.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT question_count, total_points, results_version FROM tests WHERE id = ?", (test_id,))
+        version = tuple(c.fetchone() or ())
+    return _item_analysis(test_id, version)
+
+
+@cached("item_analysis")
+def _item_analysis(test_id: int, version: Tuple) -> Dict[str, Any]:
+    """Анализ для версии теста (число вопросов, сумма баллов и results_version из tests)"""
+    data = load_response_matrix(test_id)
+    metrics = analyze_items(data["matrix"], data["max_points"])
+    alpha = metrics["alpha"]
+
+    items = []
+    for j, question in enumerate(data["questions"]):
+        values = {name: metrics[name][j]
+                  for name in ("difficulty", "discrimination", "point_biserial", "alpha_if_deleted")}
+        items.append({
+            'question_id': question['id'],
+            'question_order': question['question_order'],
+            'question_text': question['question_text'],
+            'points': question['points'],
+            **{name: _round(value) for name, value in values.items()},
+            'flags': _item_flags(**values, alpha=alpha) if data["students"] else [],
+        })
+
+    totals = data["matrix"].sum(axis=1)
+    return {
+        'test_id': test_id,
+        'students': len(data["students"]),
+        'alpha': _round(alpha),
+        'mean_score': _round(totals.mean(), 2) if totals.size else None,
+        'std_score': _round(totals.std(ddof=1), 2) if totals.size > 1 else None,
+        'items': items,
+    }
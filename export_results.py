@@ -0,0 +1,32 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(__file__))
+
+from data.db_manager import init_db, write_results_export, EXPORT_FORMATS
+
+
+def main():
+    """Потоковая выгрузка результатов тестов в CSV или JSONL"""
+    parser = argparse.ArgumentParser(description="Выгрузка результатов тестов (CSV или JSONL)")
+    parser.add_argument("output", help="Файл выгрузки")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default=None,
+                        help="Формат (по умолчанию - по расширению файла)")
+    parser.add_argument("--test", type=int, default=None, help="ID теста")
+    parser.add_argument("--group", default=None, help="Группа студентов")
+    parser.add_argument("--from", dest="date_from", default=None, help="С даты (ГГГГ-ММ-ДД)")
+    parser.add_argument("--to", dest="date_to", default=None, help="По дату включительно (ГГГГ-ММ-ДД)")
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if args.output.lower().endswith((".jsonl", ".ndjson")) else "csv")
+
+    init_db()
+    print(f"📤 Выгрузка результатов в {args.output} ({fmt})...")
+    with open(args.output, "wb") as f:
+        written = write_results_export(f, fmt, test_id=args.test, group_name=args.group,
+                                       date_from=args.date_from, date_to=args.date_to)
+    print(f"✅ Записано {written / 1024:.1f} КБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(__file__))
+
+from data.db_manager import init_db, load_roster, import_students
+
+
+def main():
+    """Импорт списка студентов из CSV/JSON файла"""
+    parser = argparse.ArgumentParser(description="Массовый импорт студентов (CSV или JSON)")
+    parser.add_argument("roster", help="Файл со столбцами username, password, full_name, group, email")
+    parser.add_argument("--role", default="Студент", help="Роль создаваемых пользователей")
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов для bcrypt")
+    args = parser.parse_args()
+
+    init_db()
+    roster = load_roster(args.roster)
+    print(f"👥 Импорт {len(roster)} записей из {args.roster}...")
+
+    report = import_students(roster, role=args.role, workers=args.workers)
+
+    for conflict in report["conflicts"]:
+        print(f"   ❌ строка {conflict['row']}: {conflict['username'] or '—'} - {conflict['reason']}")
+    print(f"✅ Добавлено: {len(report['added'])}, пропущено: {len(report['conflicts'])}")
+
+
+if __name__ == "__main__":
+    main()
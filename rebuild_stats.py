@@ -0,0 +1,15 @@
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+
+from data.db_manager import init_db, rebuild_summary_tables, rebuild_search_index, SUMMARY_TABLES
+
+
+if __name__ == "__main__":
+    init_db()
+    print("🔄 Пересчет сводных таблиц статистики...")
+    rebuild_summary_tables()
+    print(f"✅ Пересчитано таблиц: {len(SUMMARY_TABLES)} ({', '.join(SUMMARY_TABLES)})")
+    print("🔎 Перестроение поискового индекса пользователей...")
+    rebuild_search_index()
+    print("✅ Поисковый индекс перестроен")
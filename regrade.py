@@ -0,0 +1,50 @@
+import sys
+import os
+import csv
+import argparse
+sys.path.append(os.path.dirname(__file__))
+
+from data.db_manager import init_db, get_test_by_id, regrade_test, REGRADE_CHUNK
+
+DIFF_COLUMNS = ["result_id", "student_username", "attempt_number", "completed_at",
+                "old_score", "new_score", "old_max_score", "new_max_score"]
+
+
+def show_progress(done: int, total: int):
+    """Строка прогресса в терминале"""
+    print(f"\r   ⏳ {done}/{total} ({done / total * 100:.0f}%)", end="", flush=True)
+
+
+def main():
+    """Перепроверка результатов теста по исправленному ключу ответов"""
+    parser = argparse.ArgumentParser(description="Перепроверка результатов теста по текущему ключу ответов")
+    parser.add_argument("test_id", type=int, help="ID теста")
+    parser.add_argument("--chunk-size", type=int, default=REGRADE_CHUNK, help="Результатов в одной порции")
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов для проверки")
+    parser.add_argument("--dry-run", action="store_true", help="Только показать изменения, не записывая их")
+    parser.add_argument("--diff", default=None, help="CSV с изменившимися баллами (по умолчанию regrade_<id>.csv)")
+    args = parser.parse_args()
+
+    init_db()
+    test = get_test_by_id(args.test_id)
+    if not test:
+        print(f"❌ Тест {args.test_id} не найден")
+        sys.exit(1)
+
+    print(f"🔁 Перепроверка теста «{test['title']}»" + (" (без записи)" if args.dry_run else "") + "...")
+    report = regrade_test(args.test_id, chunk_size=args.chunk_size, workers=args.workers,
+                          progress=show_progress, dry_run=args.dry_run)
+    print()
+
+    diff_path = args.diff or f"regrade_{args.test_id}.csv"
+    with open(diff_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=DIFF_COLUMNS)
+        writer.writeheader()
+        writer.writerows(report["changed"])
+
+    print(f"✅ Проверено: {report['processed']} за {report['elapsed']} сек, "
+          f"изменилось баллов: {len(report['changed'])} (список: {diff_path})")
+
+
+if __name__ == "__main__":
+    main()